@@ -27,13 +27,27 @@ class ChessModelAPI:
             ready = connection.wait(self.pipes,timeout=0.001)
             if not ready:
                 continue
-            data, result_pipes = [], []
+            # a request is either one (14, 10, 9) state or a (k, 14, 10, 9) batch of states;
+            # a batch is answered with one (policies, values) message
+            data, result_pipes, sizes = [], [], []
             for pipe in ready:
                 while pipe.poll():
-                    data.append(pipe.recv())
+                    x = np.asarray(pipe.recv(), dtype=np.float32)
+                    if x.ndim == 4:
+                        data.extend(x)
+                        sizes.append(len(x))
+                    else:
+                        data.append(x)
+                        sizes.append(None)
                     result_pipes.append(pipe)
 
             data = np.asarray(data, dtype=np.float32)
             policy_ary, value_ary = self.agent_model.model.predict_on_batch(data)
-            for pipe, p, v in zip(result_pipes, policy_ary, value_ary):
-                pipe.send((p, float(v)))
+            start = 0
+            for pipe, size in zip(result_pipes, sizes):
+                if size is None:
+                    pipe.send((policy_ary[start], float(value_ary[start])))
+                    start += 1
+                else:
+                    pipe.send((policy_ary[start:start + size], value_ary[start:start + size].reshape(-1)))
+                    start += size
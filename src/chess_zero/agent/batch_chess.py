@@ -0,0 +1,287 @@
+"""
+批量棋盘：用NumPy数组同时保存N个局面，整批生成合法走法掩码、走子并判断终局，
+规则与 :class:`~chess_zero.agent.chinese_chess.Board` 一致，但不判断重复局面。
+
+局面一律以走棋方的视角保存（canonical）：轮到黑方时上下翻转棋盘并交换颜色，
+所以走法掩码直接落在 ``Config.labels`` 的下标空间里，和网络输出的策略对齐。
+"""
+import numpy as np
+
+from chess_zero.agent import chinese_chess as cc
+from chess_zero.config import Config
+
+# 上下翻转棋盘（行 r -> 9 - r），与Config.flipped_labels的翻转方式相同
+FLIP_SQUARES = np.array([(9 - sq // 9) * 9 + sq % 9 for sq in range(90)], dtype=np.intp)
+
+# 占位格：不需要检查马腿、象眼的走法指向第90格，它永远为空
+_NO_SQUARE = 90
+
+
+def _label_squares(labels):
+    from_squares = np.array([(ord(x[0]) - ord('a')) + int(x[1]) * 9 for x in labels], dtype=np.intp)
+    to_squares = np.array([(ord(x[2]) - ord('a')) + int(x[3]) * 9 for x in labels], dtype=np.intp)
+    return from_squares, to_squares
+
+
+LABEL_FROM, LABEL_TO = _label_squares(Config.labels)
+# 每个label在真实棋盘上对应的走法编码（见Move.code），按轮走方取 [BLACK] / [WHITE]
+LABEL_CODES = [FLIP_SQUARES[LABEL_FROM] * 90 + FLIP_SQUARES[LABEL_TO], LABEL_FROM * 90 + LABEL_TO]
+
+
+def _label_tables():
+    """
+    按label预先计算走法的几何信息（以白方视角）：
+    各兵种能否走出该label、马腿/象眼所在格，以及直线走法两端在前缀和数组里的下标。
+    """
+    n_labels = len(LABEL_FROM)
+    geometry = np.zeros((len(cc.PIECE_SYMBOLS), n_labels), dtype=bool)
+    legs = np.full(n_labels, _NO_SQUARE, dtype=np.intp)
+    ends = np.zeros((2, n_labels), dtype=np.intp)
+
+    for i, (from_square, to_square) in enumerate(zip(LABEL_FROM, LABEL_TO)):
+        to_bb = cc.BB_SQUARES[to_square]
+        rook = cc.BB_RANK_ATTACKS[from_square][0] | cc.BB_FILE_ATTACKS[from_square][0]
+        geometry[cc.ROOK, i] = geometry[cc.CANNON, i] = bool(rook & to_bb)
+        geometry[cc.HORSE, i] = bool(cc.BB_HORSE_ATTACKS[from_square][0] & to_bb)
+        geometry[cc.ELEPHANT, i] = bool(cc.BB_ELEPHANT_ATTACKS[from_square][0] & to_bb)
+        geometry[cc.ADVISOR, i] = bool(cc.BB_ADVISOR_ATTACKS[from_square] & to_bb)
+        geometry[cc.KING, i] = bool(cc.BB_KING_ATTACKS[from_square] & to_bb)
+        geometry[cc.PAWN, i] = bool(cc.BB_PAWN_ATTACKS[cc.WHITE][from_square] & to_bb)
+
+        rows, cols = to_square // 9 - from_square // 9, to_square % 9 - from_square % 9
+        if geometry[cc.HORSE, i]:
+            legs[i] = from_square + (9 * (rows // 2) if abs(rows) == 2 else cols // 2)
+        elif geometry[cc.ELEPHANT, i]:
+            legs[i] = (from_square + to_square) // 2
+        # 前缀和数组的前90列按行累计，后90列按列累计
+        axis = 90 if cols == 0 else 0
+        ends[:, i] = min(from_square, to_square) + axis, max(from_square, to_square) + axis
+    return geometry, legs, ends
+
+
+def _candidate_table(geometry):
+    """
+    每个兵种在每个格子上可能走出的label，补齐到同样长度，valid标出补齐的部分。
+    走法生成只检查这些候选，而不是全部label。
+    """
+    candidates = [[np.flatnonzero(geometry[piece_type] & (LABEL_FROM == square)) for square in range(90)]
+                  for piece_type in range(len(cc.PIECE_SYMBOLS))]
+    width = max(len(labels) for row in candidates for labels in row)
+    table = np.zeros((len(candidates), 90, width), dtype=np.intp)
+    valid = np.zeros((len(candidates), 90, width), dtype=bool)
+    for piece_type, row in enumerate(candidates):
+        for square, labels in enumerate(row):
+            table[piece_type, square, :len(labels)] = labels
+            valid[piece_type, square, :len(labels)] = True
+    return table, valid
+
+
+LABEL_GEOMETRY, LABEL_LEGS, LABEL_ENDS = _label_tables()
+CANDIDATES, CANDIDATES_VALID = _candidate_table(LABEL_GEOMETRY)
+
+# 能过河的兵种，双方都没有时判和（同Board.is_insufficient_material）
+_ATTACKING_PIECES = [cc.ROOK, cc.HORSE, cc.CANNON, cc.PAWN]
+
+_PIECE_BITBOARDS = [
+    (cc.PAWN, "pawns"), (cc.HORSE, "horses"), (cc.ELEPHANT, "elephants"), (cc.ROOK, "rooks"),
+    (cc.ADVISOR, "advisers"), (cc.KING, "kings"), (cc.CANNON, "cannons")
+]
+
+
+def _file_count(rows, a, b, occupied, prefix):
+    """同一列上a、b两格之间（不含两端）的棋子数，a、b不在同一列时结果无意义。"""
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    return prefix[rows, high + 90] - prefix[rows, low + 90] - occupied[rows, low]
+
+
+class BatchBoard(object):
+    """
+    N个局面的数组表示。
+
+    * ``pieces``: (N, 90) int8，走棋方视角，己方棋子为正的兵种编号，对方为负
+    * ``turn``: (N,) bool，真实的轮走方（True为白方）
+    * ``halfmove_clock`` / ``fullmove_number``: (N,) int32，与 :class:`~chinese_chess.Board` 相同
+    """
+
+    def __init__(self, pieces, turn, halfmove_clock=None, fullmove_number=None):
+        n = len(turn)
+        self.pieces = np.asarray(pieces, dtype=np.int8).reshape(n, 90)
+        self.turn = np.asarray(turn, dtype=bool)
+        self.halfmove_clock = np.zeros(n, dtype=np.int32) if halfmove_clock is None \
+            else np.asarray(halfmove_clock, dtype=np.int32)
+        self.fullmove_number = np.ones(n, dtype=np.int32) if fullmove_number is None \
+            else np.asarray(fullmove_number, dtype=np.int32)
+
+    @classmethod
+    def from_boards(cls, boards):
+        """由若干 :class:`~chinese_chess.Board` 构造。"""
+        boards = list(boards)
+        pieces = np.zeros((len(boards), 90), dtype=np.int8)
+        for i, board in enumerate(boards):
+            pieces[i] = cls._canonical_pieces(board)
+        return cls(pieces,
+                   [board.turn for board in boards],
+                   [board.halfmove_clock for board in boards],
+                   [board.fullmove_number for board in boards])
+
+    @classmethod
+    def from_fens(cls, fens):
+        return cls.from_boards(cc.Board(fen) for fen in fens)
+
+    @staticmethod
+    def _canonical_pieces(board):
+        pieces = np.zeros(90, dtype=np.int8)
+        for piece_type, name in _PIECE_BITBOARDS:
+            bb = getattr(board, name)
+            for square in cc.scan_reversed(bb & board.occupied_co[cc.WHITE]):
+                pieces[square] = piece_type
+            for square in cc.scan_reversed(bb & board.occupied_co[cc.BLACK]):
+                pieces[square] = -piece_type
+        if board.turn == cc.BLACK:
+            pieces = -pieces[FLIP_SQUARES]
+        return pieces
+
+    def __len__(self):
+        return len(self.turn)
+
+    def set_board(self, i, board):
+        """用 *board* 替换第i个局面，例如某局结束后开始新的一局。"""
+        self.pieces[i] = self._canonical_pieces(board)
+        self.turn[i] = board.turn
+        self.halfmove_clock[i] = board.halfmove_clock
+        self.fullmove_number[i] = board.fullmove_number
+
+    def board(self, i):
+        """把第i个局面转换回 :class:`~chinese_chess.Board`（不含走子历史）。"""
+        pieces = self.pieces[i] if self.turn[i] else -self.pieces[i][FLIP_SQUARES]
+        board = cc.Board(None)
+        for square in np.flatnonzero(pieces):
+            piece = int(pieces[square])
+            board._set_piece_at(int(square), abs(piece), piece > 0)
+        board.turn = bool(self.turn[i])
+        board.halfmove_clock = int(self.halfmove_clock[i])
+        board.fullmove_number = int(self.fullmove_number[i])
+        return board
+
+    def fen(self, i):
+        return self.board(i).fen()
+
+    def label_codes(self):
+        """(N, n_labels)：每个label在真实棋盘上对应的走法编码。"""
+        return np.where(self.turn[:, None], LABEL_CODES[cc.WHITE], LABEL_CODES[cc.BLACK])
+
+    def legal_mask(self):
+        """
+        (N, n_labels) bool：走棋方的合法走法掩码，规则与 ``Board.generate_legal_moves`` 相同
+        （包括不能让两将照面，吃将的走法总是合法的）。
+        """
+        pieces = self.pieces
+        n = len(pieces)
+        occupied = pieces != 0
+        padded = np.zeros((n, 91), dtype=bool)
+        padded[:, :90] = occupied
+        # 每格同一行左侧、同一列下方的棋子数，两端相减即得直线走法途经的棋子数
+        grid = occupied.reshape(n, 10, 9).astype(np.int8)
+        prefix = np.concatenate([(np.cumsum(grid, axis=2, dtype=np.int8) - grid).reshape(n, 90),
+                                 (np.cumsum(grid, axis=1, dtype=np.int8) - grid).reshape(n, 90)], axis=1)
+
+        # 只检查己方每个棋子的候选走法，形状为 (己方棋子数, 候选数)
+        boards, squares = np.nonzero(pieces > 0)
+        types = pieces[boards, squares]
+        labels = CANDIDATES[types, squares]
+        rows = boards[:, None]
+        kinds = types[:, None]
+
+        targets = pieces[rows, LABEL_TO[labels]]
+        low, high = LABEL_ENDS[0][labels], LABEL_ENDS[1][labels]
+        between = prefix[rows, high] - prefix[rows, low] - occupied[rows, low % 90]
+
+        ok = CANDIDATES_VALID[types, squares] & (targets <= 0)
+        ok &= np.where(kinds == cc.ROOK, between == 0,
+                       np.where(kinds == cc.CANNON,
+                                ((between == 0) & (targets == 0)) | ((between == 1) & (targets < 0)),
+                                ~padded[rows, LABEL_LEGS[labels]]))
+
+        # 只有将帅自己的走法、或两将同列且中间至多一子时才可能照面
+        king, their_king, facing_risk = self._kings(occupied, prefix)
+        check = np.flatnonzero(facing_risk[boards] | ((types == cc.KING) & (their_king[boards] >= 0)))
+        if len(check):
+            ok[check] &= ~self._king_facing(boards[check, None], kinds[check], labels[check], targets[check],
+                                            occupied, prefix, king, their_king)
+
+        mask = np.zeros((n, len(LABEL_FROM)), dtype=bool)
+        mask[np.broadcast_to(rows, labels.shape)[ok], labels[ok]] = True
+        return mask
+
+    def _kings(self, occupied, prefix):
+        """
+        双方将帅的位置（没有时为-1），以及两将同列且中间至多一子的局面。
+        """
+        pieces = self.pieces
+        king = np.where((pieces == cc.KING).any(axis=1), np.argmax(pieces == cc.KING, axis=1), -1)
+        their_king = np.where((pieces == -cc.KING).any(axis=1), np.argmax(pieces == -cc.KING, axis=1), -1)
+        rows = np.arange(len(pieces))
+        count = _file_count(rows, king, their_king, occupied, prefix)
+        facing_risk = (king >= 0) & (their_king >= 0) & (king % 9 == their_king % 9) & (count <= 1)
+        return king, their_king, facing_risk
+
+    @staticmethod
+    def _king_facing(rows, kinds, labels, targets, occupied, prefix, king, their_king):
+        """候选走法中走完后两将在同一列且中间无子的走法。"""
+        king, their_king = king[rows], their_king[rows]
+        from_squares, to_squares = LABEL_FROM[labels], LABEL_TO[labels]
+
+        def inside(square, a, b):
+            return ((square % 9 == a % 9) &
+                    (np.minimum(a, b) // 9 < square // 9) & (square // 9 < np.maximum(a, b) // 9))
+
+        # 非将帅的走法：当前两将之间的子数，减去离开的，加上走进来的
+        count = (_file_count(rows, king, their_king, occupied, prefix)
+                 - inside(from_squares, king, their_king)
+                 + (inside(to_squares, king, their_king) & (targets == 0)))
+        facing = (king % 9 == their_king % 9) & (count == 0)
+
+        # 将帅自己的走法：目标格与对方将帅之间的子数（不算原来的位置）
+        king_count = (_file_count(rows, to_squares, their_king, occupied, prefix)
+                      - inside(king, to_squares, their_king))
+        king_facing = (to_squares % 9 == their_king % 9) & (king_count == 0)
+
+        facing = np.where(kinds == cc.KING, king_facing, facing)
+        return facing & (to_squares != their_king)
+
+    def push(self, labels):
+        """
+        每个局面各走一步，*labels* 为 (N,) 的label下标（走棋方视角）。
+
+        :return: (N,) int8，被吃掉的棋子（对方视角为负的兵种编号，没有吃子为0）
+        """
+        labels = np.asarray(labels, dtype=np.intp)
+        rows = np.arange(len(labels))
+        from_squares, to_squares = LABEL_FROM[labels], LABEL_TO[labels]
+
+        captured = self.pieces[rows, to_squares].copy()
+        self.pieces[rows, to_squares] = self.pieces[rows, from_squares]
+        self.pieces[rows, from_squares] = 0
+
+        self.halfmove_clock = np.where(captured != 0, 0, self.halfmove_clock + 1).astype(np.int32)
+        self.fullmove_number += ~self.turn
+        self.turn = ~self.turn
+        self.pieces = -self.pieces[:, FLIP_SQUARES]
+        return captured
+
+    def result(self, legal_mask=None):
+        """
+        整批判断终局，顺序同 ``Board.result()``：走棋方的将帅被吃、150个半回合未吃子、
+        双方都没有能过河的棋子、无子可走。
+        BatchBoard不保存历史局面，不判断重复局面（``claim_draw=True`` 时的三次重复、长将、长捉）。
+
+        :return: (done, winner)，winner为1（白胜）、-1（黑胜）或0（和棋/未结束）
+        """
+        if legal_mask is None:
+            legal_mask = self.legal_mask()
+        captured_king = ~(self.pieces == cc.KING).any(axis=1)
+        attackers = np.isin(np.abs(self.pieces), _ATTACKING_PIECES).any(axis=1)
+        draw = (self.halfmove_clock >= 150) | ~attackers | ~legal_mask.any(axis=1)
+        done = captured_king | draw
+        winner = np.where(captured_king, np.where(self.turn, -1, 1), 0).astype(np.int8)
+        return done, winner
@@ -2,12 +2,62 @@
 # This is a model simplify and modify the python-chess api
 # so that it can operate chinese chess
 #
-import copy
 import logging
+import os
+from collections import namedtuple
+import pickle
+import random
+import tempfile
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 logger.level = logging.DEBUG
 
+# 生成较慢的攻击表在第一次导入时保存到模块旁边的缓存文件，之后的进程直接读取。
+# 修改任何缓存表的生成方式时都要增加版本号，旧的缓存文件会被忽略并重新生成。
+ATTACK_TABLES_VERSION = 1
+ATTACK_TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chinese_chess_tables.pickle")
+
+
+def _load_attack_tables(path=ATTACK_TABLES_PATH):
+    """读取缓存的攻击表，文件不存在、损坏或版本不符时返回空字典。"""
+    try:
+        with open(path, "rb") as f:
+            version, tables = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return {}
+    return tables if version == ATTACK_TABLES_VERSION else {}
+
+
+def _save_attack_tables(tables, path=ATTACK_TABLES_PATH):
+    """先写临时文件再替换，多个进程同时导入时也不会读到写了一半的文件；目录不可写时跳过。"""
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((ATTACK_TABLES_VERSION, tables), f, pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.debug(f"could not write attack tables to {path}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+_ATTACK_TABLES = _load_attack_tables()
+_ATTACK_TABLES_MISSING = []
+
+
+def _cached_table(name, generate):
+    """从缓存里取名为name的表，缓存里没有时调用generate()生成。"""
+    if name not in _ATTACK_TABLES:
+        _ATTACK_TABLES[name] = generate()
+        _ATTACK_TABLES_MISSING.append(name)
+    return _ATTACK_TABLES[name]
+
 COLORS = [WHITE, BLACK] = [True, False]
 COLOR_NAMES = ["black", "white"]
 
@@ -187,64 +237,18 @@ def _sliding_attacks(square, occupied, deltas, limit=_default_limit):
     return attacks
 
 
-# BB_HORSE_ATTACKS = [
-#     _sliding_attacks(
-#         sq, BB_ALL, [19, 17, 11, 7, -19, -17, -11, -7])
-#     for sq in SQUARES
-# ]
-
-"""
-  1
-0-h-2
-  3
-"""
-HORSE_INCREMENT = [(7, -11), (17, 19), (-7, 11), (-19, -17)]
-BB_HORSE_ATTACKS = []
-for sq in SQUARES:
-    outer_list = []
-    for s in range(15, -1, -1):
-        inner = 0
-        for i in scan_reversed(s):
-            t = _sliding_attacks(sq, BB_ALL, HORSE_INCREMENT[i])
-            inner |= t
-        outer_list.append(inner)
-    BB_HORSE_ATTACKS.append(outer_list)
-
 BB_KING_ATTACKS = [
     _sliding_attacks(
         sq, BB_ALL, [9, 1, -9, -1],
         lambda x: _king_white_limit(x) or _king_black_limit(x)) for sq in SQUARES
 ]
 
-# BB_ELEPHANT_ATTACKS = [
-#     _sliding_attacks(
-#         sq, BB_ALL, [20, 16, -20, -16],
-#         lambda x: _elephant_white_limit(x) or _elephant_black_limit(x)) for sq in SQUARES
-# ]
-
-"""
-0---1
-|-E-|
-2---3
-"""
-ELEPHANT_INCREMENT = [(16,), (20,), (-20,), (-16,)]
-BB_ELEPHANT_ATTACKS = []
-
 def _elephant_limit(x):
     if 0 <= x < 45:
         return _elephant_white_limit(x)
     else:
         return _elephant_black_limit(x)
 
-for sq in SQUARES:
-    outer_list = []
-    for s in range(15, -1, -1):
-        inner = 0
-        for i in scan_reversed(s):
-            t = _sliding_attacks(sq, BB_ALL, ELEPHANT_INCREMENT[i], _elephant_limit)
-            inner |= t
-        outer_list.append(inner)
-    BB_ELEPHANT_ATTACKS.append(outer_list)
 
 BB_ADVISOR_ATTACKS = [
     _sliding_attacks(
@@ -324,9 +328,133 @@ def _attack_table(deltas):
     return mask_table, attack_table
 
 
-BB_DIAG_MASKS, BB_DIAG_ATTACKS = _attack_table([-10, -8, 8, 10])
-BB_FILE_MASKS, BB_FILE_ATTACKS = _attack_table([-9, 9])
-BB_RANK_MASKS, BB_RANK_ATTACKS = _attack_table([-1, 1])
+BB_DIAG_MASKS, BB_DIAG_ATTACKS = _cached_table("diag", lambda: _attack_table([-10, -8, 8, 10]))
+BB_FILE_MASKS, BB_FILE_ATTACKS = _cached_table("file", lambda: _attack_table([-9, 9]))
+BB_RANK_MASKS, BB_RANK_ATTACKS = _cached_table("rank", lambda: _attack_table([-1, 1]))
+
+
+def _leg_attacks(square, occupied, jumps, limit=_default_limit):
+    """
+    计算马、象这类会被蹩腿/塞眼的棋子的攻击范围。
+    :param square:
+    :param occupied:
+    :param jumps: [((行偏移, 列偏移), (腿的行偏移, 腿的列偏移)), ...]
+    :param limit:
+    :return:
+    """
+    attacks = 0
+    row, col = square_row(square), square_col(square)
+    for (dr, dc), (lr, lc) in jumps:
+        r, c = row + dr, col + dc
+        if not (0 <= r < 10 and 0 <= c < 9) or not limit(get_square(r, c)):
+            continue
+        # 腿一定在跳跃的范围之内，不用再检查越界
+        if not occupied & BB_SQUARES[get_square(row + lr, col + lc)]:
+            attacks |= BB_SQUARES[get_square(r, c)]
+    return attacks
+
+
+def _leg_table(jumps, limit=_default_limit, origin_limit=_default_limit):
+    """
+    与_attack_table相同：mask为每个位置可能蹩腿的格子，attack按mask的子集索引。
+    不满足origin_limit的位置没有攻击。
+    """
+    mask_table = []
+    attack_table = []
+
+    for square in SQUARES:
+        attacks = {}
+
+        mask = 0
+        row, col = square_row(square), square_col(square)
+        for (dr, dc), (lr, lc) in jumps:
+            r, c = row + dr, col + dc
+            if 0 <= r < 10 and 0 <= c < 9 and limit(get_square(r, c)) and origin_limit(square):
+                mask |= BB_SQUARES[get_square(row + lr, col + lc)]
+        for subset in _carry_rippler(mask):
+            attacks[subset] = _leg_attacks(square, subset, jumps, limit) if origin_limit(square) else BB_VOID
+
+        attack_table.append(attacks)
+        mask_table.append(mask)
+
+    return mask_table, attack_table
+
+
+HORSE_JUMPS = [((dr, dc), (0, dc // 2) if abs(dc) == 2 else (dr // 2, 0))
+               for dr, dc in [(1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1)]]
+# 反向：从目标格出发，找能跳到这里的马，腿在目标格的斜邻格
+HORSE_ATTACKER_JUMPS = [((-dr, -dc), (lr - dr, lc - dc)) for (dr, dc), (lr, lc) in HORSE_JUMPS]
+ELEPHANT_JUMPS = [((dr, dc), (dr // 2, dc // 2)) for dr, dc in [(2, 2), (2, -2), (-2, 2), (-2, -2)]]
+
+BB_HORSE_MASKS, BB_HORSE_ATTACKS = _cached_table("horse", lambda: _leg_table(HORSE_JUMPS))
+BB_HORSE_ATTACKER_MASKS, BB_HORSE_ATTACKERS = _cached_table("horse_attackers", lambda: _leg_table(HORSE_ATTACKER_JUMPS))
+BB_ELEPHANT_MASKS, BB_ELEPHANT_ATTACKS = _cached_table("elephant", lambda: _leg_table(ELEPHANT_JUMPS, _elephant_limit))
+# 象眼在两端的中点，反向表只需排除非象位的目标格（例如过河的格子）
+BB_ELEPHANT_ATTACKER_MASKS, BB_ELEPHANT_ATTACKERS = _cached_table(
+    "elephant_attackers", lambda: _leg_table(ELEPHANT_JUMPS, _elephant_limit, _elephant_limit))
+
+
+
+def _reverse_table(attack_table):
+    """
+    反转攻击表：返回的表中第target项为能攻击到target的所有位置。
+    将、士、兵的走法受九宫、过河的限制，并不对称，不能直接拿正向表查攻击者。
+    """
+    return [sum(BB_SQUARES[sq] for sq in SQUARES if attack_table[sq] & BB_SQUARES[target])
+            for target in SQUARES]
+
+
+BB_KING_ATTACKERS = _reverse_table(BB_KING_ATTACKS)
+BB_ADVISOR_ATTACKERS = _reverse_table(BB_ADVISOR_ATTACKS)
+BB_PAWN_ATTACKERS = [_reverse_table(BB_PAWN_ATTACKS[BLACK]), _reverse_table(BB_PAWN_ATTACKS[WHITE])]
+
+
+def _cannon_attacks(square, occupied, deltas):
+    """
+    计算炮的吃子范围：沿每个方向越过第一个棋子（炮架）之后遇到的第一个棋子。
+    :param square:
+    :param occupied:
+    :param deltas:
+    :return:
+    """
+    attacks = 0
+    for delta in deltas:
+        sq = square
+        screen = False
+        while True:
+            sq += delta
+            if not _default_limit(sq) or square_distance(sq, sq - delta) > 2:
+                break
+            if occupied & BB_SQUARES[sq]:
+                if screen:
+                    attacks |= BB_SQUARES[sq]
+                    break
+                screen = True
+    return attacks
+
+
+def _cannon_attack_table(deltas):
+    """
+    与_attack_table相同，按BB_RANK_MASKS/BB_FILE_MASKS的遮挡子集索引。
+    掩码不含边缘格子，因此生成时把边缘当作有子，结果需要再与occupied求交。
+    """
+    attack_table = []
+
+    for square in SQUARES:
+        attacks = {}
+
+        mask = _sliding_attacks(square, BB_VOID, deltas) & ~_edges(square)
+        edges = _sliding_attacks(square, BB_VOID, deltas) & _edges(square)
+        for subset in _carry_rippler(mask):
+            attacks[subset] = _cannon_attacks(square, subset | edges, deltas)
+
+        attack_table.append(attacks)
+
+    return attack_table
+
+
+BB_CANNON_FILE_ATTACKS = _cached_table("cannon_file", lambda: _cannon_attack_table([-9, 9]))
+BB_CANNON_RANK_ATTACKS = _cached_table("cannon_rank", lambda: _cannon_attack_table([-1, 1]))
 
 
 def _rays():
@@ -345,6 +473,9 @@ def _rays():
                 BB_RANK_ATTACKS的第一个参数代表起始棋子，第二个参数代表棋子的遮挡情况
                 下可行的行攻击方法，详情见上面的attack_table函数。
                 """
+                # 象棋里没有斜线滑动的棋子，但每行必须补齐90项，否则后面的下标会错位。
+                rays_row.append(0)
+                between_row.append(0)
             elif BB_RANK_ATTACKS[a][0] & bb_b:
                 rays_row.append(BB_RANK_ATTACKS[a][0] | bb_a)
                 between_row.append(
@@ -363,12 +494,48 @@ def _rays():
     return rays, between
 
 
-BB_RAYS, BB_BETWEEN = _rays()
+BB_RAYS, BB_BETWEEN = _cached_table("rays", _rays)
+
+if _ATTACK_TABLES_MISSING:
+    _save_attack_tables(_ATTACK_TABLES)
+
+
+def _zobrist_keys(seed=0x5A0B):
+    """
+    生成Zobrist哈希所需的随机数，种子固定，保证不同进程间哈希值一致。
+    :return: (棋子-位置表, 轮走方表)，棋子-位置表按[color][piece_type][square]索引
+    """
+    rng = random.Random(seed)
+    pieces = [[[rng.getrandbits(64) for _ in SQUARES] for _ in range(len(PIECE_SYMBOLS))]
+              for _ in COLORS]
+    return pieces, rng.getrandbits(64)
+
+
+ZOBRIST_PIECES, ZOBRIST_TURN = _zobrist_keys()
+
+# 子力分值，按piece_type索引，与chess_env.testeval相同
+PIECE_VALUES = [0, 1, 4, 3.25, 5, 2, 3, 4]
+
+
+def _piece_square_values():
+    """
+    可选的位置分，按[color][piece_type][square]索引：目前只有过河兵（卒）加1分。
+    """
+    values = [[[0] * len(SQUARES) for _ in PIECE_SYMBOLS] for _ in COLORS]
+    for square in SQUARES:
+        values[WHITE][PAWN][square] = 1 if square >= 45 else 0
+        values[BLACK][PAWN][square] = 1 if square < 45 else 0
+    return values
+
+
+PIECE_SQUARE_VALUES = _piece_square_values()
 
 
 class Piece(object):
     """A piece with type and color."""
 
+    __slots__ = ("piece_type", "color")
+
     def __init__(self, piece_type, color):
         self.piece_type = piece_type
         self.color = color
@@ -420,8 +587,13 @@ class Move(object):
     piece type.
 
     Drops and null moves are supported.
+
+    Moves are never modified after construction, so they can be shared
+    between copies of a board's move stack.
     """
 
+    __slots__ = ("from_square", "to_square", "promotion", "drop")
+
     def __init__(self, from_square, to_square, promotion=None, drop=None):
         self.from_square = from_square
         self.to_square = to_square
@@ -446,6 +618,15 @@ class Move(object):
     def ucci(self):
         return square_name(self.from_square) + square_name(self.to_square)
 
+    def code(self):
+        """Gets the integer encoding ``from_square * 90 + to_square`` of the move."""
+        return self.from_square * 90 + self.to_square
+
+    @classmethod
+    def from_code(cls, code):
+        """Creates a move from its :func:`~Move.code()`."""
+        return cls(code // 90, code % 90)
+
     @classmethod
     def null(cls):
         """
@@ -509,8 +690,14 @@ class BaseBoard(object):
     is ``None``, an empty board is created.
     """
 
+    __slots__ = ("occupied_co", "pawns", "horses", "elephants", "rooks", "advisers",
+                 "kings", "cannons", "promoted", "occupied", "_zobrist", "_material", "_positional",
+                 "_fen_rows", "_board_fen")
+
     def __init__(self, board_fen=STARTING_BOARD_FEN):
         self.occupied_co = [BB_VOID, BB_VOID]
+        self._material = [0, 0]
+        self._positional = [0, 0]
 
         if board_fen is None:
             self._clear_board()
@@ -535,6 +722,11 @@ class BaseBoard(object):
         self.occupied_co[BLACK] = BB_ROW_9 | BB_B7 | BB_H7 | BB_A6 | BB_C6 | BB_E6 | BB_G6 | BB_I6
         self.occupied = self.occupied_co[WHITE] | self.occupied_co[BLACK]
 
+        self._zobrist = self._board_zobrist()
+        self._material, self._positional = self._board_material()
+        self._fen_rows = [None] * 10
+        self._board_fen = None
+
     def reset_board(self):
         self._set_board_fen(STARTING_BOARD_FEN)
 
@@ -553,6 +745,12 @@ class BaseBoard(object):
         self.occupied_co[BLACK] = BB_VOID
         self.occupied = BB_VOID
 
+        self._zobrist = 0
+        self._material = [0, 0]
+        self._positional = [0, 0]
+        self._fen_rows = [None] * 10
+        self._board_fen = None
+
     def clear_board(self):
         """Clears the board."""
         self._clear_board()
@@ -565,6 +763,29 @@ class BaseBoard(object):
             color = bool(self.occupied_co[WHITE] & mask)
             return Piece(piece_type, color)
 
+    def _board_zobrist(self):
+        """从头计算棋子部分的Zobrist哈希，不含轮走方。"""
+        h = 0
+        for square in scan_reversed(self.occupied):
+            color = bool(self.occupied_co[WHITE] & BB_SQUARES[square])
+            h ^= ZOBRIST_PIECES[color][self.piece_type_at(square)][square]
+        return h
+
+    def _board_material(self):
+        """从头计算双方的子力和位置分，按color索引。"""
+        material = [0, 0]
+        positional = [0, 0]
+        for square in scan_reversed(self.occupied):
+            color = bool(self.occupied_co[WHITE] & BB_SQUARES[square])
+            piece_type = self.piece_type_at(square)
+            material[color] += PIECE_VALUES[piece_type]
+            positional[color] += PIECE_SQUARE_VALUES[color][piece_type][square]
+        return material, positional
+
+    def material(self, color):
+        """color方棋子的子力总和（见 :data:`PIECE_VALUES`），随走子增量更新。"""
+        return self._material[color]
+
     def piece_type_at(self, square):
         """Gets the piece type without type at the given square."""
         mask = BB_SQUARES[square]
@@ -589,34 +810,46 @@ class BaseBoard(object):
     def board_fen(self):
         """
         Gets the board FEN.
+
+        结果缓存到下一次改动棋子为止；每一行的FEN也分别缓存，走一步只需重新生成起点和终点所在的行。
         """
+        if self._board_fen is None:
+            rows = self._fen_rows
+            for row in range(10):
+                if rows[row] is None:
+                    rows[row] = self._row_fen(row)
+            self._board_fen = "/".join(reversed(rows))
+        return self._board_fen
+
+    def _row_fen(self, row):
+        """第row行（从a列到i列）的FEN，不创建Piece对象。"""
+        if not self.occupied & BB_ROW[row]:
+            return "9"
         builder = []
         empty = 0
-
-        for square in SQUARES_180:
-            piece = self.piece_at(square)
-
-            if not piece:
+        white = self.occupied_co[WHITE]
+        for square in range(row * 9, row * 9 + 9):
+            piece_type = self.piece_type_at(square)
+            if not piece_type:
                 empty += 1
-            else:
-                if empty:
-                    builder.append(str(empty))
-                    empty = 0
-                builder.append(piece.symbol())
-
-            if BB_SQUARES[square] & BB_COL_I:
-                if empty:
-                    builder.append(str(empty))
-                    empty = 0
-
-                if square != I0:
-                    builder.append("/")
-
+                continue
+            if empty:
+                builder.append(str(empty))
+                empty = 0
+            symbol = PIECE_SYMBOLS[piece_type]
+            builder.append(symbol.upper() if white & BB_SQUARES[square] else symbol)
+        if empty:
+            builder.append(str(empty))
         return "".join(builder)
 
+    def _invalidate_fen(self, square):
+        self._fen_rows[square // 9] = None
+        self._board_fen = None
+
     def _remove_piece_at(self, square):
         piece_type = self.piece_type_at(square)
         mask = BB_SQUARES[square]
+        color = bool(self.occupied_co[WHITE] & mask)
 
         if piece_type == PAWN:
             self.pawns ^= mask
@@ -641,6 +874,11 @@ class BaseBoard(object):
 
         self.promoted &= ~mask
 
+        self._zobrist ^= ZOBRIST_PIECES[color][piece_type][square]
+        self._material[color] -= PIECE_VALUES[piece_type]
+        self._positional[color] -= PIECE_SQUARE_VALUES[color][piece_type][square]
+        self._invalidate_fen(square)
+
         return piece_type
 
     def _set_piece_at(self, square, piece_type, color, promoted=False):
@@ -666,6 +904,11 @@ class BaseBoard(object):
         self.occupied ^= mask
         self.occupied_co[color] ^= mask
 
+        self._zobrist ^= ZOBRIST_PIECES[color][piece_type][square]
+        self._material[color] += PIECE_VALUES[piece_type]
+        self._positional[color] += PIECE_SQUARE_VALUES[color][piece_type][square]
+        self._invalidate_fen(square)
+
         if promoted:
             self.promoted ^= mask
 
@@ -727,7 +970,8 @@ class BaseBoard(object):
 
     def copy(self):
         """Creates a copy of the board."""
-        board = type(self)(None)
+        # 跳过 __init__：不必先清空棋盘再逐项覆盖
+        board = object.__new__(type(self))
 
         board.pawns = self.pawns
         board.horses = self.horses
@@ -737,9 +981,15 @@ class BaseBoard(object):
         board.kings = self.kings
         board.cannons = self.cannons
 
-        board.occupied_co[WHITE] = self.occupied_co[WHITE]
-        board.occupied_co[BLACK] = self.occupied_co[BLACK]
+        board.occupied_co = [self.occupied_co[BLACK], self.occupied_co[WHITE]]
         board.occupied = self.occupied
+        board.promoted = self.promoted
+
+        board._zobrist = self._zobrist
+        board._material = self._material[:]
+        board._positional = self._positional[:]
+        board._fen_rows = self._fen_rows[:]
+        board._board_fen = self._board_fen
 
         return board
 
@@ -770,22 +1020,22 @@ class Board(BaseBoard):
     Use :func:`chess.Board.from_chess960_pos()` to create a board with one
     of the Chess960 starting positions.
 
-    It's safe to set :data:`~Board.turn`, :data:`~Board.castling_rights`,
-    :data:`~Board.ep_square`, :data:`~Board.halfmove_clock` and
+    It's safe to set :data:`~Board.turn`, :data:`~Board.halfmove_clock` and
     :data:`~Board.fullmove_number` directly.
     """
     ucci_variant = "chinese chess"
     starting_fen = STARTING_FEN
 
+    __slots__ = ("chess960", "turn", "halfmove_clock", "fullmove_number",
+                 "move_stack", "stack", "_legal_cache")
+
     def __init__(self, fen=STARTING_FEN, chess960=False):
 
         # noinspection PyTypeChecker
         BaseBoard.__init__(self, None)
 
         self.chess960 = chess960
-
-        self.pseudo_legal_moves = PseudoLegalMoveGenerator(self)
-        self.legal_moves = LegalMoveGenerator(self)
+        self._legal_cache = None
 
         self.move_stack = []
         self.stack = []
@@ -797,7 +1047,21 @@ class Board(BaseBoard):
         else:
             self.set_fen(fen)
 
+    @property
+    def pseudo_legal_moves(self):
+        return PseudoLegalMoveGenerator(self)
+
+    @property
+    def legal_moves(self):
+        return LegalMoveGenerator(self)
+
     def copy(self, stack=True):
+        """
+        Creates a copy of the board.
+
+        :class:`~Move` and :class:`~_BoardState` entries are immutable, so
+        with *stack* the move stack and state stack are copied shallowly.
+        """
         board = super(Board, self).copy()
 
         board.chess960 = self.chess960
@@ -805,10 +1069,14 @@ class Board(BaseBoard):
         board.turn = self.turn
         board.fullmove_number = self.fullmove_number
         board.halfmove_clock = self.halfmove_clock
+        board._legal_cache = self._legal_cache
 
         if stack:
-            board.move_stack = copy.deepcopy(self.move_stack)
-            board.stack = copy.copy(self.stack)
+            board.move_stack = self.move_stack[:]
+            board.stack = self.stack[:]
+        else:
+            board.move_stack = []
+            board.stack = []
 
         return board
 
@@ -869,6 +1137,17 @@ class Board(BaseBoard):
             str(self.fullmove_number)
         ])
 
+    def zobrist_hash(self):
+        """
+        获取当前局面的64位Zobrist哈希（棋子位置和轮走方，不含回合计数）。
+
+        棋子部分由 :func:`~Board.push()` 增量更新，因此读取的代价是O(1)，
+        可以代替FEN字符串作为局面的键。
+        """
+        if self.turn == WHITE:
+            return self._zobrist
+        return self._zobrist ^ ZOBRIST_TURN
+
     def epd(self, shredder=False, en_passant="legal", promoted=None, **operations):
         """
         Gets an EPD representation of the current position.
@@ -940,6 +1219,54 @@ class Board(BaseBoard):
         # Clear move stack.
         self.clear_stack()
 
+    def position(self):
+        """
+        导出当前局面为不可变、可哈希的 :class:`~Position`，不含走子历史。
+
+        只复制已经维护好的位棋盘、计数和哈希，代价是O(1)。
+        """
+        return Position(self.pawns, self.horses, self.elephants, self.rooks, self.advisers, self.kings,
+                        self.cannons, self.occupied_co[WHITE], self.occupied_co[BLACK], self.turn,
+                        self.halfmove_clock, self.fullmove_number, self.zobrist_hash(),
+                        self._material[WHITE], self._material[BLACK],
+                        self._positional[WHITE], self._positional[BLACK])
+
+    def set_position(self, position):
+        """
+        把局面设置为 *position*（见 :func:`~Board.position()`），并清空走子历史。
+        """
+        self.pawns = position.pawns
+        self.horses = position.horses
+        self.elephants = position.elephants
+        self.rooks = position.rooks
+        self.advisers = position.advisers
+        self.kings = position.kings
+        self.cannons = position.cannons
+        self.promoted = BB_VOID
+
+        self.occupied_co[WHITE] = position.occupied_w
+        self.occupied_co[BLACK] = position.occupied_b
+        self.occupied = position.occupied_w | position.occupied_b
+
+        self.turn = position.turn
+        self.halfmove_clock = position.halfmove_clock
+        self.fullmove_number = position.fullmove_number
+
+        self._zobrist = position.zobrist if position.turn == WHITE else position.zobrist ^ ZOBRIST_TURN
+        self._material = [position.material_b, position.material_w]
+        self._positional = [position.positional_b, position.positional_w]
+        self._fen_rows = [None] * 10
+        self._board_fen = None
+
+        self.clear_stack()
+
+    @classmethod
+    def from_position(cls, position):
+        """由 :class:`~Position` 创建新的棋盘，不需要解析FEN。"""
+        board = cls(None)
+        board.set_position(position)
+        return board
+
     def parse_ucci(self, ucci):
         """
         Parses the given move in UCCI notation.
@@ -981,9 +1308,8 @@ class Board(BaseBoard):
         """
         bb_square = BB_SQUARES[square]
 
-        # 炮在这里不加处理
         if bb_square & self.cannons:
-            return BB_ALL
+            return self._cannon_attacks_mask(square)
 
         if bb_square & self.pawns:
             if bb_square & self.occupied_co[WHITE]:
@@ -991,11 +1317,11 @@ class Board(BaseBoard):
             else:
                 return BB_PAWN_ATTACKS[BLACK][square]
         elif bb_square & self.horses:
-            return BB_HORSE_ATTACKS[square][self._get_horse_around(square)]
+            return BB_HORSE_ATTACKS[square][BB_HORSE_MASKS[square] & self.occupied]
         elif bb_square & self.kings:
             return BB_KING_ATTACKS[square]
         elif bb_square & self.elephants:
-            return BB_ELEPHANT_ATTACKS[square][self._get_elephant_around(square)]
+            return BB_ELEPHANT_ATTACKS[square][BB_ELEPHANT_MASKS[square] & self.occupied]
         elif bb_square & self.advisers:
             return BB_ADVISOR_ATTACKS[square]
         else:
@@ -1005,22 +1331,6 @@ class Board(BaseBoard):
                     BB_FILE_MASKS[square] & self.occupied])
             return attacks
 
-    def _get_horse_around(self, square):
-        ans = 0
-        dd = [-1, 9, 1, -9]
-        for i, d in enumerate(dd):
-            if 0 <= square + d < 90 and (self.occupied & BB_SQUARES[square + d]):
-                ans |= 1 << i
-        return ans
-
-    def _get_elephant_around(self, square):
-        ans = 0
-        dd = [8, 10, -10, -8]
-        for i, d in enumerate(dd):
-            if 0 <= square + d < 90 and (self.occupied & BB_SQUARES[square + d]):
-                ans |= 1 << i
-        return ans
-
     def _attackers_mask(self, color, square, occupied):
         rank_pieces = BB_RANK_MASKS[square] & occupied
         file_pieces = BB_FILE_MASKS[square] & occupied
@@ -1028,21 +1338,17 @@ class Board(BaseBoard):
         rooks = self.rooks
 
         attackers = (
-                (BB_KING_ATTACKS[square] & self.kings) |
-                (BB_HORSE_ATTACKS[square][self._get_horse_around(square)] & self.horses) |
+                (BB_KING_ATTACKERS[square] & self.kings) |
+                (BB_ADVISOR_ATTACKERS[square] & self.advisers) |
+                (BB_ELEPHANT_ATTACKERS[square][BB_ELEPHANT_ATTACKER_MASKS[square] & occupied] & self.elephants) |
+                (BB_HORSE_ATTACKERS[square][BB_HORSE_ATTACKER_MASKS[square] & occupied] & self.horses) |
                 (BB_RANK_ATTACKS[square][rank_pieces] & rooks) |
                 (BB_FILE_ATTACKS[square][file_pieces] & rooks) |
-                (BB_PAWN_ATTACKS[not color][square] & self.pawns))
-
-        # Find the cannon, check if the square is in it.
-        cannons = self.cannons & self.occupied_co[color]
-        cannon_bb = 0
-        for c in scan_reversed(cannons):
-            attacked = list(self._cannon_attack(c, color))
-            if square in attacked:
-                cannon_bb |= BB_SQUARES[c]
+                (BB_PAWN_ATTACKERS[color][square] & self.pawns))
 
-        attackers |= cannon_bb
+        # 炮的吃子是对称的：隔一个炮架能打到square的炮，从square隔一个炮架也能看到它。
+        attackers |= ((BB_CANNON_RANK_ATTACKS[square][rank_pieces] |
+                       BB_CANNON_FILE_ATTACKS[square][file_pieces]) & self.cannons & occupied)
 
         return attackers & self.occupied_co[color]
 
@@ -1056,31 +1362,46 @@ class Board(BaseBoard):
         return self._attackers_mask(color, square, self.occupied)
 
     def is_king_face_king(self, move):
-        new_kings = self.kings
-        if not new_kings:
+        """
+        检查走完这步之后两个将帅是否在同一列上直接对面（中间没有棋子）。
+        吃掉对方将帅的走法不算对面。
+        """
+        from_bb = BB_SQUARES[move.from_square]
+        to_bb = BB_SQUARES[move.to_square]
+
+        kings = self.kings & ~from_bb & ~to_bb
+        if self.kings & from_bb:
+            kings |= to_bb
+        if not kings & (kings - 1):
             return False
-        if self.piece_type_at(move.from_square) == KING:
-            new_kings = (new_kings | BB_SQUARES[move.to_square]) ^ BB_SQUARES[move.from_square]
-        new_occupied = (self.occupied | BB_SQUARES[move.to_square]) ^ BB_SQUARES[move.from_square]
-        new_occupied_co = [BB_VOID, BB_VOID]
-        new_occupied_co[self.turn] = (self.occupied_co[self.turn] | BB_SQUARES[move.to_square]) ^ BB_SQUARES[move.from_square]
-        new_occupied_co[not self.turn] = self.occupied_co[not self.turn]
-        
-        king_white = msb(new_occupied_co[True] & new_kings)
-        king_black = msb(new_occupied_co[False] & new_kings)
-        col_white = square_col(king_white)
-        col_black = square_col(king_black)
-        if col_white == col_black:
-            mask = new_kings
-            row_white = square_row(king_white)
-            for i in range(0, row_white):
-                mask = mask | (new_occupied & BB_SQUARES[get_square(i, col_white)])
-            row_black = square_row(king_black)
-            for i in range(row_black+1, 10):
-                mask = mask | (new_occupied & BB_SQUARES[get_square(i, col_black)])
-            mask = new_occupied & BB_COL[col_white] ^ mask
-            return not mask
-        return False
+
+        king_a = msb(kings)
+        king_b = msb(kings & ~BB_SQUARES[king_a])
+        if square_col(king_a) != square_col(king_b):
+            return False
+
+        occupied = (self.occupied & ~from_bb) | to_bb
+        return not BB_BETWEEN[king_a][king_b] & occupied
+
+    def _king_face_pins(self, king, their_king):
+        """
+        在整个局面上只计算一次“对面笑”的牵制：
+        返回(被牵制的棋子, 被牵制棋子允许的目标格)。
+
+        两将不在同一列，或中间有两个以上的棋子时，没有牵制；
+        中间只有一个棋子时，它只能在两将之间移动（或吃掉对方的将）；
+        中间没有棋子时，每一步都必须挡在中间。
+        """
+        if square_col(king) != square_col(their_king):
+            return BB_VOID, BB_ALL
+
+        between = BB_BETWEEN[king][their_king]
+        blockers = between & self.occupied
+        if blockers & (blockers - 1):
+            return BB_VOID, BB_ALL
+
+        pinned = blockers if blockers else self.occupied_co[self.turn]
+        return pinned, between | BB_SQUARES[their_king]
 
     def is_pseudo_legal(self, move):
         # Null moves are not pseudo legal.
@@ -1131,8 +1452,7 @@ class Board(BaseBoard):
         return not self._is_safe(king, False, move)
 
     def is_legal(self, move):
-        return not self.is_variant_end() and self.is_pseudo_legal(move) and not self.is_king_face_king(move)
-        # and not self.is_into_check(move)
+        return not move.promotion and not move.drop and move.code() in self._legal_moves_cache()[2]
 
     def is_variant_end(self):
         """
@@ -1147,139 +1467,47 @@ class Board(BaseBoard):
         """
         return False
 
-    def _cannon_attack(self, square, turn=None):
+    def _cannon_attacks_mask(self, square):
         """
-        生成炮的可能走法。
+        炮的走法：不吃子时同车（只能走到空格），吃子时必须隔一个炮架。
         :param square: int，[0,90)，代表棋子的位置
         :return:
         """
-        if turn is None:
-            turn = self.turn
-
-        r = square_row(square)
-        c = square_col(square)
-        bb_same_row = BB_ROW[r] & self.occupied
-        bb_same_col = BB_COL[c] & self.occupied
-        pieces_row_index = list(scan_reversed(bb_same_row))
-        pieces_col_index = list(scan_reversed(bb_same_col))
-        # 生成攻击
-        r_index = pieces_row_index.index(square)
-        c_index = pieces_col_index.index(square)
-
-        if r_index - 2 >= 0:
-            to_square = pieces_row_index[r_index - 2]
-            if BB_SQUARES[to_square] & self.occupied_co[~turn]:
-                yield Move(square, to_square)
-
-        if r_index + 2 < len(pieces_row_index):
-            to_square = pieces_row_index[r_index + 2]
-            if BB_SQUARES[to_square] & self.occupied_co[~turn]:
-                yield Move(square, to_square)
-
-        if c_index - 2 >= 0:
-            to_square = pieces_col_index[c_index - 2]
-            if BB_SQUARES[to_square] & self.occupied_co[~turn]:
-                yield Move(square, to_square)
-        if c_index + 2 < len(pieces_col_index):
-            to_square = pieces_col_index[c_index + 2]
-            if BB_SQUARES[to_square] & self.occupied_co[~turn]:
-                yield Move(square, to_square)
-
-    def _cannon_move(self, square):
-        """
-        生成炮的可能走法。
-        :param square: int，[0,90)，代表棋子的位置
-        :return:
-        """
-        r = square_row(square)
-        c = square_col(square)
-        bb_same_row = BB_ROW[r] & self.occupied
-        bb_same_col = BB_COL[c] & self.occupied
-        pieces_row_index = list(scan_reversed(bb_same_row))
-        pieces_col_index = list(scan_reversed(bb_same_col))
-
-        # 生成移动代码（不包含攻击）
-        r_index = pieces_row_index.index(square)
-        if r_index + 1 < len(pieces_row_index):
-            r_down_edge = pieces_row_index[r_index + 1] + 1
-        else:
-            r_down_edge = get_square(r, 0)
-        if r_index - 1 >= 0:
-            r_up_edge = pieces_row_index[r_index - 1] - 1
-        else:
-            r_up_edge = get_square(r, 8)
-
-        for x in range(r_down_edge, r_up_edge + 1):
-            if x == square:
-                continue
-            yield Move(square, x)
-
-        c_index = pieces_col_index.index(square)
-        if c_index + 1 < len(pieces_col_index):
-            r_left_edge = pieces_col_index[c_index + 1] + 9
-        else:
-            r_left_edge = get_square(0, c)
-        if c_index - 1 >= 0:
-            r_right_edge = pieces_col_index[c_index - 1] - 9
-        else:
-            r_right_edge = get_square(9, c)
-
-        for x in range(r_left_edge, r_right_edge + 9, 9):
-            if x == square:
-                continue
-            yield Move(square, x)
+        rank_pieces = BB_RANK_MASKS[square] & self.occupied
+        file_pieces = BB_FILE_MASKS[square] & self.occupied
+        moves = (BB_RANK_ATTACKS[square][rank_pieces] | BB_FILE_ATTACKS[square][file_pieces]) & ~self.occupied
+        captures = (BB_CANNON_RANK_ATTACKS[square][rank_pieces] |
+                    BB_CANNON_FILE_ATTACKS[square][file_pieces]) & self.occupied
+        return moves | captures
 
     def generate_pseudo_legal_moves(self, from_mask=BB_ALL, to_mask=BB_ALL):
         """
         生成当前局面下，所有种类棋子可行的移动路径。
 
+        """
+        for from_square, targets in self._generate_pseudo_legal_targets(from_mask, to_mask):
+            for to_square in scan_reversed(targets):
+                yield Move(from_square, to_square)
+
+    def _generate_pseudo_legal_targets(self, from_mask=BB_ALL, to_mask=BB_ALL):
+        """
+        按棋子生成走法：每次返回(起始位置, 目标位置的bitboard)。
         """
         our_pieces = self.occupied_co[self.turn]
 
         # Generate piece moves.
-        non_pawns = our_pieces & ~self.pawns & ~self.cannons & from_mask
+        non_pawns = our_pieces & ~self.pawns & from_mask
         for from_square in scan_reversed(non_pawns):
-            # logger.debug(f'from square: {square_name(from_square)}')
-            moves = self.attacks_mask(from_square) & ~our_pieces & to_mask
-            for to_square in scan_reversed(moves):
-                # logger.debug(f'to square: {square_name(to_square)}')
-                yield Move(from_square, to_square)
-
-        cannons = self.cannons & self.occupied_co[self.turn] & from_mask
-        for c in scan_reversed(cannons):
-            yield from self._cannon_attack(c)
-
-        for c in scan_reversed(cannons):
-            yield from self._cannon_move(c)
+            targets = self.attacks_mask(from_square) & ~our_pieces & to_mask
+            if targets:
+                yield from_square, targets
 
         # The remaining moves are all pawn moves.
-        pawns = self.pawns & self.occupied_co[self.turn] & from_mask
-        if not pawns:
-            return
-
-        # Generate pawn captures.
-        capturers = pawns
-        for from_square in scan_reversed(capturers):
-            targets = (BB_PAWN_ATTACKS[self.turn][from_square] & ~self.occupied_co[self.turn])
-
-            for to_square in scan_reversed(targets):
-                # if square_row(to_square) in [0, 9]:
-                #     yield Move(from_square, to_square, ROOK)
-                # else:
-                yield Move(from_square, to_square)
-
-        # Prepare pawn advance generation.
-        # if self.turn == WHITE:
-        #     single_moves = pawns << 9 & ~self.occupied
-        # else:
-        #     single_moves = pawns >> 9 & ~self.occupied
-        #
-        # single_moves &= to_mask
-        #
-        # # Generate single pawn moves.
-        # for to_square in scan_reversed(single_moves):
-        #     from_square = to_square + (9 if self.turn == BLACK else -9)
-        #     yield Move(from_square, to_square)
+        pawns = self.pawns & our_pieces & from_mask
+        for from_square in scan_reversed(pawns):
+            targets = BB_PAWN_ATTACKS[self.turn][from_square] & ~our_pieces & to_mask
+            if targets:
+                yield from_square, targets
 
     def _generate_evasions(self, king, checkers, from_mask=BB_ALL, to_mask=BB_ALL):
         sliders = checkers & self.rooks
@@ -1322,37 +1550,150 @@ class Board(BaseBoard):
 
     def generate_legal_moves(self, from_mask=BB_ALL, to_mask=BB_ALL):
         """
-        生成当前的可行走法, 具体的先检查“将”或“帅”的位置，检查是否被将军，然后分别处理。
-        现在generate_pseudo_legal_moves用法还不清楚。
+        生成当前的可行走法：伪合法走法中去掉走完之后将帅对面的走法。
         :param from_mask:
         :param to_mask:
         :return:
         """
+        for from_square, targets in self._generate_legal_targets(from_mask, to_mask):
+            for to_square in scan_reversed(targets):
+                yield Move(from_square, to_square)
+
+    def generate_legal_move_list(self, from_mask=BB_ALL, to_mask=BB_ALL):
+        """
+        与 :func:`~Board.generate_legal_moves()` 相同，但直接返回列表。
+        """
+        return [Move(from_square, to_square)
+                for from_square, targets in self._generate_legal_targets(from_mask, to_mask)
+                for to_square in scan_reversed(targets)]
+
+    def generate_legal_move_codes(self, from_mask=BB_ALL, to_mask=BB_ALL):
+        """
+        以整数编码（见 :func:`~Move.code()`）返回可行走法的列表，不创建Move对象。
+        """
+        return [from_square * 90 + to_square
+                for from_square, targets in self._generate_legal_targets(from_mask, to_mask)
+                for to_square in scan_reversed(targets)]
+
+    def evaluate(self, absolute=False, positional=False):
+        """
+        子力评估，与 ``chess_env.testeval(board.fen(), absolute)`` 相同：
+        (白方子力 - 黑方子力) / 双方子力之和，乘3后经tanh压缩到(-1, 1)。
+        *absolute* 为False时以走棋方为正。
+
+        双方子力在走子时增量维护，读取的代价是O(1)；*positional* 为True时计入位置分
+        （见 :data:`PIECE_SQUARE_VALUES`）。
+        """
+        white, black = self._material[WHITE], self._material[BLACK]
+        if positional:
+            white += self._positional[WHITE]
+            black += self._positional[BLACK]
+        if not white + black:
+            return 0.0
+        v = (white - black) / (white + black)
+        if not absolute and self.turn == BLACK:
+            v = -v
+        return np.tanh(v * 3)
+
+    def canonical_input_planes(self):
+        """
+        直接由bitboard生成走棋方视角的 (14, 10, 9) float32 输入平面，
+        与 ``chess_env.canon_input_planes(board.fen())`` 的结果相同。
+
+        平面顺序为 ``KAEHRCPkaehrcp``，前7个是走棋方的棋子。白方走棋时第0行是棋盘的第9行；
+        黑方走棋时棋盘上下翻转，第0行就是棋盘的第0行。
+        """
+        us, them = self.occupied_co[self.turn], self.occupied_co[not self.turn]
+        pieces = (self.kings, self.advisers, self.elephants, self.horses, self.rooks, self.cannons, self.pawns)
+        data = b"".join((bb & color).to_bytes(12, "little") for color in (us, them) for bb in pieces)
+        bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder="little").reshape(14, 96)
+        planes = bits[:, :90].reshape(14, 10, 9)
+        if self.turn == WHITE:
+            planes = planes[:, ::-1, :]
+        return planes.astype(np.float32)
+
+    def legal_move_codes(self):
+        """
+        当前局面合法走法的编码（见 :func:`~Move.code()`）元组，顺序同 :func:`~Board.generate_legal_moves()`。
+
+        结果按局面的Zobrist哈希缓存，并随 :func:`~Board.push()` / :func:`~Board.pop()` 保存和恢复，
+        终局判断、MCTS展开和走法校验在同一局面只生成一次走法。
+        """
+        return self._legal_moves_cache()[1]
+
+    def _legal_moves_cache(self):
+        key = self.zobrist_hash()
+        cache = self._legal_cache
+        if cache is None or cache[0] != key:
+            codes = tuple(self.generate_legal_move_codes())
+            cache = self._legal_cache = (key, codes, frozenset(codes))
+        return cache
+
+    def _generate_legal_targets(self, from_mask=BB_ALL, to_mask=BB_ALL):
+        """
+        牵制只在每个局面计算一次，不在对面线上的非将帅走法不需要逐个检查。
+        """
         if self.is_variant_end():
             return
 
-        # king_mask = self.kings & self.occupied_co[self.turn]
-        # if king_mask:
-        #     king = msb(king_mask)
-        #     blockers = False  # self._slider_blockers(king)
-        #     checkers = self.attackers_mask(not self.turn, king)
-        #     if checkers:
-        #         # 当前被将军
-        #         for move in self._generate_evasions(king, checkers, from_mask, to_mask):
-        #             if self._is_safe(king, blockers, move):
-        #                 logger.debug(f'Move: {move}')
-        #                 yield move
-        #     else:
-        #         # 当前未被将军
-        #         for move in self.generate_pseudo_legal_moves(from_mask, to_mask):
-        #             if self._is_safe(king, blockers, move):
-        #                 logger.debug(f'Move: {move}')
-        #                 yield move
-        # else:
-        for move in self.generate_pseudo_legal_moves(from_mask, to_mask):
-            if not self.is_king_face_king(move):
-                logger.debug(f'Move: {move}')
-                yield move
+        king = self.king(self.turn)
+        their_king = self.king(not self.turn)
+        if king is None or their_king is None:
+            yield from self._generate_pseudo_legal_targets(from_mask, to_mask)
+            return
+
+        pinned, pin_targets = self._king_face_pins(king, their_king)
+        their_file = BB_COL[square_col(their_king)]
+
+        for from_square, targets in self._generate_pseudo_legal_targets(from_mask, to_mask):
+            if from_square == king:
+                # 只有走到对方将帅所在列上的目标格需要检查，最多两个。
+                occupied = self.occupied & ~BB_SQUARES[king]
+                for to_square in scan_reversed(targets & their_file):
+                    if not BB_BETWEEN[to_square][their_king] & occupied:
+                        targets &= ~BB_SQUARES[to_square]
+            elif BB_SQUARES[from_square] & pinned:
+                targets &= pin_targets
+
+            if targets:
+                yield from_square, targets
+
+    def perft(self, depth):
+        """
+        统计从当前局面出发走depth步的叶子节点数，用来校验走法生成并测速。
+
+        被吃掉将帅的一方没有后续走法。
+        """
+        if depth < 1:
+            return 1
+        if self.king(self.turn) is None:
+            return 0
+
+        moves = self.generate_legal_move_list()
+        if depth == 1:
+            return len(moves)
+
+        nodes = 0
+        for move in moves:
+            self.push(move)
+            nodes += self.perft(depth - 1)
+            self.pop()
+        return nodes
+
+    def divide(self, depth):
+        """
+        按第一步走法拆分 :func:`~Board.perft()` 的结果，返回{ucci: 节点数}，
+        用于定位走法生成的错误。
+        """
+        counts = {}
+        if self.king(self.turn) is None:
+            return counts
+
+        for move in self.generate_legal_move_list():
+            self.push(move)
+            counts[move.ucci()] = self.perft(depth - 1)
+            self.pop()
+        return counts
 
     def is_game_over(self, claim_draw=False):
         """
@@ -1373,14 +1714,71 @@ class Board(BaseBoard):
         if self.is_seventyfive_moves():
             return True
 
+        # Insufficient material.
+        if self.is_insufficient_material():
+            return True
+
         # Stalemate or checkmate.
-        if not any(self.generate_legal_moves()):
+        if not self.legal_move_codes():
+            return True
+
+        if claim_draw and self.can_claim_threefold_repetition():
             return True
 
         return False
 
+    def _repetition_plies(self, count=3):
+        """
+        当前局面（比较Zobrist哈希）第count次出现时，返回从最早一次出现到现在的步数，否则返回0。
+
+        吃子后局面不可能重复，所以只需要回看 :data:`~Board.halfmove_clock` 步以内、
+        同一方走棋的局面。
+        """
+        seen = 1
+        for plies in range(2, min(self.halfmove_clock, len(self.stack)) + 1, 2):
+            if self.stack[-plies].zobrist == self._zobrist:
+                seen += 1
+                if seen >= count:
+                    return plies
+        return 0
+
+    def is_repetition(self, count=3):
+        """Checks if the current position has occurred *count* times since the last capture."""
+        return bool(self._repetition_plies(count))
+
     def can_claim_threefold_repetition(self):
-        return False
+        return self.is_repetition(3)
+
+    def _chased_squares(self, color):
+        """color方攻击到的、对方没有保护的车马炮相士（不含将帅和兵卒）。"""
+        chased = set()
+        targets = self.occupied_co[not color] & ~self.kings & ~self.pawns
+        for square in scan_reversed(targets):
+            if self.attackers_mask(color, square) and not self.attackers_mask(not color, square):
+                chased.add(square)
+        return chased
+
+    def _repetition_result(self, plies):
+        """
+        按长将、长捉判定重复局面的结果：重放最近plies步，一方每步都将军而另一方没有时长将方负；
+        双方都没有长将时，一方每步都新捉对方无根子而另一方没有时长捉方负；其余情况为和棋。
+        """
+        board = self.copy()
+        checks = [True, True]
+        chases = [True, True]
+        for _ in range(plies):
+            mover = not board.turn
+            king = board.king(board.turn)
+            checks[mover] &= king is not None and board.is_attacked_by(mover, king)
+            chased = board._chased_squares(mover)
+            board.pop()
+            chases[mover] &= bool(chased - board._chased_squares(mover))
+
+        if checks[WHITE] != checks[BLACK]:
+            return "0-1" if checks[WHITE] else "1-0"
+        if not checks[WHITE] and chases[WHITE] != chases[BLACK]:
+            return "0-1" if chases[WHITE] else "1-0"
+        return "1/2-1/2"
 
     def result(self, claim_draw=False):
         """
@@ -1395,20 +1793,22 @@ class Board(BaseBoard):
         if self.my_checkmate():
             return "0-1" if self.turn == WHITE else "1-0"
 
-        # Draw claimed.
-        # if claim_draw:  # and self.can_claim_draw():
-        #     return "1/2-1/2"
+        # Threefold repetition, judged by the perpetual check and chase rules.
+        if claim_draw:
+            plies = self._repetition_plies(3)
+            if plies:
+                return self._repetition_result(plies)
 
         # Seventyfive-move rule or fivefold repetition.
         if self.is_seventyfive_moves():  # or self.is_fivefold_repetition():
             return "1/2-1/2"
 
-        # # Insufficient material.
-        # if self.is_insufficient_material():
-        # 	return "1/2-1/2"
+        # Insufficient material.
+        if self.is_insufficient_material():
+            return "1/2-1/2"
 
         # Stalemate.
-        if not any(self.generate_legal_moves()):
+        if not self.legal_move_codes():
             return "1/2-1/2"
 
         # Undetermined.
@@ -1441,6 +1841,14 @@ class Board(BaseBoard):
             return True
         return False
 
+    def is_insufficient_material(self):
+        """
+        双方都没有能过河的车、马、炮、兵时，将帅无法被吃掉，判和。
+
+        只需检查随走子增量维护的bitboard，代价是O(1)。
+        """
+        return not (self.rooks | self.horses | self.cannons | self.pawns)
+
     @staticmethod
     def _replace_num(s):
         for i in range(1, 10):
@@ -1543,20 +1951,6 @@ class Board(BaseBoard):
         #     elif self.turn == BLACK and square_rank(move.to_square) == 0:
         #         self.castling_rights &= ~BB_RANK_1
 
-        # Handle special pawn moves.
-        if piece_type == PAWN:
-            diff = move.to_square - move.from_square
-
-            if diff == 16 and square_row(move.from_square) == 1:
-                self.ep_square = move.from_square + 8
-            elif diff == -16 and square_row(move.from_square) == 6:
-                self.ep_square = move.from_square - 8
-            # elif move.to_square == ep_square and abs(diff) in [7, 9] and not captured_piece_type:
-            #     # Remove pawns captured en passant.
-            #     down = -8 if self.turn == WHITE else 8
-            #     capture_square = ep_square + down
-            #     captured_piece_type = self._remove_piece_at(capture_square)
-
         # Promotion.
         # if move.promotion:
         #     promoted = True
@@ -1589,9 +1983,36 @@ class Board(BaseBoard):
         # Swap turn.
         self.turn = not self.turn
 
+    def pop(self):
+        """
+        Restores the previous position and returns the last move from the stack.
+
+        :raises: :exc:`IndexError` if the stack is empty.
+        """
+        move = self.move_stack.pop()
+        self.stack.pop().restore(self)
+        # 整个棋盘的FEN随状态恢复，按行的缓存只需作废这步棋改动过的行
+        if move:
+            self._fen_rows[move.to_square // 9] = None
+            self._fen_rows[move.from_square // 9] = None
+        return move
+
+    def peek(self):
+        """
+        Gets the last move from the move stack.
+
+        :raises: :exc:`IndexError` if the move stack is empty.
+        """
+        return self.move_stack[-1]
+
 
 class _BoardState(object):
 
+    __slots__ = ("pawns", "horses", "elephants", "rooks", "advisers", "kings", "cannons",
+                 "occupied_w", "occupied_b", "occupied", "zobrist", "board_fen",
+                 "material_w", "material_b", "positional_w", "positional_b",
+                 "turn", "halfmove_clock", "fullmove_number", "legal_cache")
+
     def __init__(self, board: Board):
         self.pawns = board.pawns
         self.horses = board.horses
@@ -1605,9 +2026,66 @@ class _BoardState(object):
         self.occupied_b = board.occupied_co[BLACK]
         self.occupied = board.occupied
 
+        self.zobrist = board._zobrist
+        self.board_fen = board._board_fen
+        self.material_w = board._material[WHITE]
+        self.material_b = board._material[BLACK]
+        self.positional_w = board._positional[WHITE]
+        self.positional_b = board._positional[BLACK]
+
         self.turn = board.turn
         self.halfmove_clock = board.halfmove_clock
         self.fullmove_number = board.fullmove_number
+        self.legal_cache = board._legal_cache
+
+    def restore(self, board: Board):
+        board.pawns = self.pawns
+        board.horses = self.horses
+        board.elephants = self.elephants
+        board.rooks = self.rooks
+        board.advisers = self.advisers
+        board.kings = self.kings
+        board.cannons = self.cannons
+
+        board.occupied_co[WHITE] = self.occupied_w
+        board.occupied_co[BLACK] = self.occupied_b
+        board.occupied = self.occupied
+
+        board._zobrist = self.zobrist
+        board._board_fen = self.board_fen
+        board._material[WHITE] = self.material_w
+        board._material[BLACK] = self.material_b
+        board._positional[WHITE] = self.positional_w
+        board._positional[BLACK] = self.positional_b
+
+        board.turn = self.turn
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        board._legal_cache = self.legal_cache
+
+
+class Position(namedtuple("Position", [
+        "pawns", "horses", "elephants", "rooks", "advisers", "kings", "cannons", "occupied_w", "occupied_b",
+        "turn", "halfmove_clock", "fullmove_number", "zobrist",
+        "material_w", "material_b", "positional_w", "positional_b"])):
+    """
+    不可变的局面：各兵种与双方的位棋盘、轮走方、回合计数，以及含轮走方的Zobrist哈希
+    （同 :func:`~Board.zobrist_hash()`）和双方子力。
+
+    可以作为字典的键、在线程和进程之间传递（可pickle），用 :func:`~Board.from_position()`
+    还原成棋盘。相等比较包括回合计数，哈希值直接取Zobrist哈希。
+    """
+
+    __slots__ = ()
+
+    def __hash__(self):
+        return hash(self.zobrist)
+
+    def board(self):
+        return Board.from_position(self)
+
+    def fen(self):
+        return self.board().fen()
 
 
 class PseudoLegalMoveGenerator(object):
@@ -1650,16 +2128,15 @@ class LegalMoveGenerator(object):
         self.board = board
 
     def __bool__(self):
-        return any(self.board.generate_legal_moves())
+        return bool(self.board.legal_move_codes())
 
     __nonzero__ = __bool__
 
     def count(self):
-        # List conversion is faster than iterating.
-        return len(list(self))
+        return len(self.board.legal_move_codes())
 
     def __iter__(self):
-        return self.board.generate_legal_moves()
+        return (Move.from_code(code) for code in self.board.legal_move_codes())
 
     def __contains__(self, move):
         return self.board.is_legal(move)
@@ -9,6 +9,7 @@ from chess_zero.config import Config
 from chess_zero.env.chess_env import Winner
 from chess_zero.env.chess_env import ChineseChessEnv
 from chess_zero.agent import chinese_chess
+from chess_zero.lib.opening_book import load_opening_book
 
 logger = getLogger(__name__)
 # logger.setLevel(DEBUG)
@@ -22,17 +23,27 @@ logger.addHandler(ch)
 
 # these are from AGZ nature paper
 class VisitStats:
+    """
+    One tree node. Children are the legal moves in ``legal_move_codes()`` order,
+    and their N, W, Q and P live in parallel arrays indexed by that slot.
+    """
     def __init__(self):
-        self.a = defaultdict(ActionStats)
-        self.sum_n = 0
+        self.policy = None  # network policy over all labels, spread to the children on first selection
+        self.codes = None
+        self.n = None
+        self.w = None
+        self.q = None
         self.p = None
+        self.noise = None  # Dirichlet noise over the children, drawn once while this node is the search root
+        self.sum_n = 0
 
-
-class ActionStats:
-    def __init__(self):
-        self.n = 0
-        self.w = 0
-        self.q = 0
+    def expand(self, codes, p):
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.n = np.zeros(len(codes))
+        self.w = np.zeros(len(codes))
+        self.q = np.zeros(len(codes))
+        self.p = p
+        self.policy = None
 
 
 class ChineseChessPlayer:
@@ -44,10 +55,8 @@ class ChineseChessPlayer:
         self.play_config = play_config or self.config.play
         self.labels_n = config.n_labels
         self.labels = config.labels
-        self.move_lookup = {
-            chinese_chess.Move.from_ucci(move): i
-            for move, i in zip(self.labels, range(self.labels_n))
-        }
+        self.book = load_opening_book(config, self.play_config)
+        self.reset_mcts()
         if dummy:
             return
 
@@ -58,16 +67,48 @@ class ChineseChessPlayer:
     def reset_mcts(self):
         self.tree = defaultdict(VisitStats)
 
+    def prune_tree(self, env):
+        """
+        Keeps only the nodes reachable from env's position through visited moves, so the
+        search for this move continues from the statistics gathered on earlier moves.
+        The tree is keyed by position, so a depth first walk with push/pop on a scratch
+        board finds the reachable keys.
+        """
+        old_tree = self.tree
+        self.reset_mcts()
+        board = env.board.copy(stack=False)
+        root = old_tree.pop(state_key(env), None)
+        if root is None:
+            return
+        self.tree[state_key(env)] = root
+
+        def visited_codes(node):
+            return iter([] if node.codes is None else node.codes[node.n > 0].tolist())
+
+        stack = [visited_codes(root)]
+        while stack:
+            code = next(stack[-1], None)
+            if code is None:
+                stack.pop()
+                if stack:
+                    board.pop()
+                continue
+            board.push(chinese_chess.Move.from_code(code))
+            key = board.zobrist_hash()
+            node = old_tree.pop(key, None)  # popped, so transpositions are walked once
+            if node is None:
+                board.pop()
+                continue
+            self.tree[key] = node
+            stack.append(visited_codes(node))
+
     def deboog(self, env):
         print(env.testeval())
 
         state = state_key(env)
         my_visit_stats = self.tree[state]
-        stats = []
-        for action, a_s in my_visit_stats.a.items():
-            moi = self.move_lookup[action]
-            stats.append(np.asarray([a_s.n, a_s.w, a_s.q, a_s.p, moi]))
-        stats = np.asarray(stats)
+        stats = np.stack([my_visit_stats.n, my_visit_stats.w, my_visit_stats.q, my_visit_stats.p,
+                          Config.move_index[my_visit_stats.codes]], axis=1)
         a = stats[stats[:, 0].argsort()[::-1]]
 
         for s in a:
@@ -78,10 +119,43 @@ class ChineseChessPlayer:
                   f'p: {s[3]:7.5f}')
 
     def action(self, env, can_stop=True) -> str:
-        self.reset_mcts()
+        book_action = self.book_action(env)
+        if book_action is not None:
+            return book_action
+
+        self.prepare_search(env)
 
         # for tl in range(self.play_config.thinking_loop):
         root_value, naked_value = self.search_moves(env)
+        return self.choose_action(env, root_value, can_stop)
+
+    def book_action(self, env):
+        """
+        :return: a move from the opening book while within book_depth, otherwise None
+        """
+        if self.book is not None and env.num_halfmoves < self.play_config.book_depth:
+            move = self.book.choose(env.board, self.play_config.book_diversity)
+            if move is not None:
+                return move.ucci()  # book moves are not recorded as training data
+        return None
+
+    def prepare_search(self, env):
+        if self.play_config.reuse_tree:
+            self.prune_tree(env)
+        else:
+            self.reset_mcts()
+        self.reset_root_noise(env)
+
+    def reset_root_noise(self, env):
+        root = self.tree.get(state_key(env))
+        if root is not None:
+            root.noise = None  # a reused root gets fresh noise for this search
+
+    def choose_action(self, env, root_value, can_stop=True):
+        """
+        Picks the move from the visit counts of the finished search at env's position and
+        records the training sample, or returns None to resign.
+        """
         policy = self.calc_policy(env)
         my_action = int(np.random.choice(range(self.labels_n), p=self.apply_temperature(policy, env.num_halfmoves)))
 
@@ -95,10 +169,14 @@ class ChineseChessPlayer:
             return self.config.labels[my_action]
 
     def search_moves(self, env) -> (float, float):
+        if self.play_config.search_mode == "batched":
+            return self.search_moves_batched(env)
         futures = []
+        # one env per thread, each simulation walks it down and back up with step/undo
+        env_pool = [env.copy() for _ in range(self.play_config.search_threads)]
         with ThreadPoolExecutor(max_workers=self.play_config.search_threads) as executor:
             for _ in range(self.play_config.simulation_num_per_move):
-                futures.append(executor.submit(self.search_my_move, env=env.copy(), is_root_node=True))
+                futures.append(executor.submit(self.search_from_root, env_pool))
         vals = [f.result() for f in futures]
 
         # vals = []
@@ -107,6 +185,96 @@ class ChineseChessPlayer:
 
         return np.max(vals), vals[0]  # vals[0] is kind of racy
 
+    def search_from_root(self, env_pool) -> float:
+        env = env_pool.pop()  # borrow
+        try:
+            return self.search_my_move(env, is_root_node=True)
+        finally:
+            env_pool.append(env)
+
+    def search_moves_batched(self, env) -> (float, float):
+        """
+        Single threaded alternative to the thread pool search. Simulations walk the tree one
+        after another with virtual loss until leaf_batch_size new leaves are pending, the
+        leaves go to the model as one batch, and then every pending path is backed up.
+        A walk that reaches a leaf already pending in the batch is taken back and ends the batch.
+        """
+        env = env.copy()
+        vals = []
+        remaining = self.play_config.simulation_num_per_move
+        while remaining > 0:
+            pending = []
+            while remaining > 0 and len(pending) < self.play_config.leaf_batch_size:
+                path, leaf_v = self.select_leaf(env, pending)
+                if path is None:
+                    break  # collision with a pending leaf
+                remaining -= 1
+                if leaf_v is not None:
+                    vals.append(self.backup(path, leaf_v))
+            if pending:
+                policies, values = self.predict_batch(np.asarray([planes for _, _, planes in pending]))
+                for (path, node, _), leaf_p, leaf_v in zip(pending, policies, values):
+                    node.policy = leaf_p
+                    vals.append(self.backup(path, float(leaf_v)))
+
+        return np.max(vals), vals[0]
+
+    def select_leaf(self, env, pending):
+        """
+        Walks from the root to a leaf, adding virtual loss on the way, and leaves env at the root again.
+        :return: (path, leaf_v): path is the list of (node, slot) edges taken. leaf_v is the value of a
+            terminal leaf, or None when the leaf was added to pending for evaluation. path is None when
+            the walk ran into a leaf that is already pending.
+        """
+        virtual_loss = self.play_config.virtual_loss
+        path = []
+        leaf_v = None
+        while True:
+            if env.done:
+                leaf_v = 0 if env.winner == Winner.draw else (1 if env.white_won == env.white_to_move else -1)
+                break
+            state = state_key(env)
+            node = self.tree.get(state)
+            unexpanded = node is None or (node.policy is None and node.codes is None)
+            if unexpanded and not any(node is leaf for _, leaf, _ in pending):
+                node = self.tree[state]
+                pending.append((path, node, env.canonical_input_planes()))
+                break
+            if unexpanded:
+                # pending in this batch: take the walk back
+                for parent, i in path:
+                    parent.sum_n -= virtual_loss
+                    parent.n[i] -= virtual_loss
+                    parent.w[i] += virtual_loss
+                    parent.q[i] = parent.w[i] / parent.n[i] if parent.n[i] else 0
+                path = None
+                break
+            i = self.select_action_q_and_u(env, is_root_node=not path)
+            node.sum_n += virtual_loss
+            node.n[i] += virtual_loss
+            node.w[i] += -virtual_loss
+            node.q[i] = node.w[i] / node.n[i]
+            path.append((node, i))
+            env.step_move(chinese_chess.Move.from_code(int(node.codes[i])))
+
+        for _ in range(len(path or [])):
+            env.undo()
+        return path, leaf_v
+
+    def backup(self, path, leaf_v) -> float:
+        """
+        Backs leaf_v (from the POV of the side to move at the leaf) up the path, removing virtual loss.
+        :return: the value from the POV of the side to move at the root
+        """
+        virtual_loss = self.play_config.virtual_loss
+        for node, i in reversed(path):
+            leaf_v = -leaf_v
+            node.sum_n += -virtual_loss + 1
+            node.n[i] += -virtual_loss + 1
+            node.w[i] += virtual_loss + leaf_v
+            node.q[i] = node.w[i] / node.n[i]
+        return leaf_v
+
     def search_my_move(self, env: ChineseChessEnv, is_root_node=False) -> float:
         """
         Q, V is value for this Player(always white).
@@ -116,42 +284,44 @@ class ChineseChessPlayer:
         if env.done:
             if env.winner == Winner.draw:
                 return 0
-            # assert env.whitewon != env.white_to_move # side to move can't be winner!
-            return -1
+            # the side to move loses when the game ends by capture, but it can win by a repetition
+            # verdict against the side that just moved, or by tablebase adjudication in an env with a tablebase
+            return 1 if env.white_won == env.white_to_move else -1
 
         state = state_key(env)
 
         with self.node_lock[state]:
             if state not in self.tree:
                 leaf_p, leaf_v = self.expand_and_evaluate(env)
-                self.tree[state].p = leaf_p
+                self.tree[state].policy = leaf_p
                 return leaf_v  # I'm returning everything from the POV of side to move
 
             # SELECT STEP
-            action_t = self.select_action_q_and_u(env, is_root_node)
+            i = self.select_action_q_and_u(env, is_root_node)
 
             virtual_loss = self.play_config.virtual_loss
 
             my_visit_stats = self.tree[state]
-            my_stats = my_visit_stats.a[action_t]
+            action_t = int(my_visit_stats.codes[i])
 
             my_visit_stats.sum_n += virtual_loss
-            my_stats.n += virtual_loss
-            my_stats.w += -virtual_loss
-            my_stats.q = my_stats.w / my_stats.n
+            my_visit_stats.n[i] += virtual_loss
+            my_visit_stats.w[i] += -virtual_loss
+            my_visit_stats.q[i] = my_visit_stats.w[i] / my_visit_stats.n[i]
 
-        env.step(action_t.ucci())
+        env.step_move(chinese_chess.Move.from_code(action_t))
         leaf_v = self.search_my_move(env)  # next move from enemy POV
         leaf_v = -leaf_v
+        env.undo()
 
         # BACKUP STEP
         # on returning search path
         # update: N, W, Q
         with self.node_lock[state]:
             my_visit_stats.sum_n += -virtual_loss + 1
-            my_stats.n += -virtual_loss + 1
-            my_stats.w += virtual_loss + leaf_v
-            my_stats.q = my_stats.w / my_stats.n
+            my_visit_stats.n[i] += -virtual_loss + 1
+            my_visit_stats.w[i] += virtual_loss + leaf_v
+            my_visit_stats.q[i] = my_visit_stats.w[i] / my_visit_stats.n[i]
 
         return leaf_v
 
@@ -163,10 +333,8 @@ class ChineseChessPlayer:
         state_planes = env.canonical_input_planes()
 
         leaf_p, leaf_v = self.predict(state_planes)
-        # these are canonical policy and value (i.e. side to move is "white")
-
-        if not env.white_to_move:
-            leaf_p = Config.flip_policy(leaf_p)  # get it back to python-chess form
+        # these are canonical policy and value (i.e. side to move is "white"),
+        # select_action_q_and_u reads the policy through Config.flipped_move_index for black
 
         return leaf_p, leaf_v
 
@@ -177,30 +345,29 @@ class ChineseChessPlayer:
         self.pipe_pool.append(pipe)
         return ret
 
-    # @profile
-    def select_action_q_and_u(self, env, is_root_node) -> chinese_chess.Move:
+    def predict_batch(self, state_planes):
+        """
+        :param state_planes: (k, 14, 10, 9) canonical input planes
+        :return: (k, n_labels) policies and (k,) values from a single round trip
+        """
+        return self.predict(state_planes)
 
+    # @profile
+    def select_action_q_and_u(self, env, is_root_node) -> int:
+        """
+        :return: the slot of the selected child, i.e. the index into the node's codes/n/w/q/p arrays
+        """
         # this method is called with state locked
         state = state_key(env)
 
         my_visitstats = self.tree[state]
 
-        if not hasattr(my_visitstats, 'p'):
-            pass
-
-        moves_count = 0
-        if my_visitstats.p is not None:  # push p to edges
-            tot_p = 1e-8
-            for mov in env.board.legal_moves:
-                logger.debug(f'Move: {mov}')
-                moves_count += 1
-                # print(f'Move: {mov}')
-                mov_p = my_visitstats.p[self.move_lookup[mov]]  # move_lookup[mov]代表指定动作的序号
-                my_visitstats.a[mov].p = mov_p
-                tot_p += mov_p
-            for a_s in my_visitstats.a.values():
-                a_s.p /= tot_p
-            my_visitstats.p = None
+        if my_visitstats.policy is not None:  # push p to edges
+            codes = env.board.legal_move_codes()
+            move_index = Config.move_index if env.white_to_move else Config.flipped_move_index
+            # move_index[codes]代表各个走法在(规范化的)策略里的序号
+            move_p = my_visitstats.policy[move_index[list(codes)]]
+            my_visitstats.expand(codes, move_p / (np.sum(move_p) + 1e-8))
 
         # U(s,a)分式中的分子部分
         xx_ = np.sqrt(my_visitstats.sum_n + 1)  # sqrt of sum(N(s, b); for all b)
@@ -209,21 +376,15 @@ class ChineseChessPlayer:
         c_puct = self.play_config.c_puct
         dir_alpha = self.play_config.dirichlet_alpha
 
-        best_s = -999
-        best_action = None
-
         # argmax(Q(s_t, a) + U(s_t, a))
-        # 对每个动作计算a_t，选取收益最高的action
-        for action, a_s in my_visitstats.a.items():
-            p_ = a_s.p
-            if is_root_node:
-                p_ = (1 - e) * p_ + e * np.random.dirichlet([dir_alpha])
-            b = a_s.q + c_puct * p_ * xx_ / (1 + a_s.n)
-            if b > best_s:
-                best_s = b
-                best_action = action
-        assert best_action is not None
-        return best_action
+        # 对所有走法一次算出Q+U，选取收益最高的下标
+        p_ = my_visitstats.p
+        if is_root_node and e > 0:
+            if my_visitstats.noise is None:
+                my_visitstats.noise = np.random.dirichlet(np.full(len(p_), dir_alpha))
+            p_ = (1 - e) * p_ + e * my_visitstats.noise
+        b = my_visitstats.q + c_puct * p_ * xx_ / (1 + my_visitstats.n)
+        return int(np.argmax(b))
 
     def apply_temperature(self, policy, turn):
         tau = np.power(self.play_config.tau_decay_rate, turn + 1)
@@ -246,8 +407,7 @@ class ChineseChessPlayer:
         state = state_key(env)
         my_visitstats = self.tree[state]
         policy = np.zeros(self.labels_n)
-        for action, a_s in my_visitstats.a.items():
-            policy[self.move_lookup[action]] = a_s.n
+        policy[Config.move_index[my_visitstats.codes]] = my_visitstats.n
 
         policy /= np.sum(policy)
         return policy
@@ -255,7 +415,7 @@ class ChineseChessPlayer:
     def sl_action(self, observation, my_action, weight=1):
         policy = np.zeros(self.labels_n)
 
-        k = self.move_lookup[chinese_chess.Move.from_ucci(my_action)]
+        k = Config.move_index[chinese_chess.Move.from_ucci(my_action).code()]
         policy[k] = weight
 
         self.moves.append([observation, list(policy)])
@@ -271,6 +431,28 @@ class ChineseChessPlayer:
             move += [z]
 
 
-def state_key(env: ChineseChessEnv) -> str:
-    fen = env.board.fen().rsplit(' ', 1)  # drop the move clock
-    return fen[0]
+def game_data(env: ChineseChessEnv, white: ChineseChessPlayer, black: ChineseChessPlayer) -> list:
+    """
+    Scores the recorded moves of both players with the result of the finished game.
+    :return: the training data of the game, white and black moves interleaved
+    """
+    if env.winner == Winner.white:
+        black_win = -1
+    elif env.winner == Winner.black:
+        black_win = 1
+    else:
+        black_win = 0
+
+    black.finish_game(black_win)
+    white.finish_game(-black_win)
+
+    data = []
+    for i in range(len(white.moves)):
+        data.append(white.moves[i])
+        if i < len(black.moves):
+            data.append(black.moves[i])
+    return data
+
+
+def state_key(env: ChineseChessEnv) -> int:
+    return env.board.zobrist_hash()  # pieces and side to move, no move clocks
@@ -115,11 +115,27 @@ def create_ucci_labels():
     return labels_array
 
 
+def create_move_index(labels):
+    """
+    按走法编码from_square * 90 + to_square（见chinese_chess.Move.code）索引的labels下标表，
+    不在labels里的走法为-1。
+    """
+    index = np.full(90 * 90, -1, dtype=np.int32)
+    for i, label in enumerate(labels):
+        from_square = (ord(label[0]) - ord('a')) + int(label[1]) * 9
+        to_square = (ord(label[2]) - ord('a')) + int(label[3]) * 9
+        index[from_square * 90 + to_square] = i
+    return index
+
+
 class Config:
     unflipped_index = None
     labels = create_ucci_labels()
     n_labels = int(len(labels))
     flipped_labels = flipped_ucci_labels()
+    # move code -> index of the move in labels, and of its mirrored move (for black-to-move canonical policies)
+    move_index = create_move_index(labels)
+    flipped_move_index = create_move_index(flipped_labels)
 
     def __init__(self, config_type="mini"):
         self.opts = Options()
@@ -143,14 +159,19 @@ class Config:
 
     @staticmethod
     def flip_policy(pol):
-        return np.asarray([pol[ind] for ind in Config.unflipped_index])
+        return np.asarray(pol)[Config.unflipped_index]
 
 
-Config.unflipped_index = [Config.labels.index(x) for x in Config.flipped_labels]
+Config.unflipped_index = np.asarray([Config.labels.index(x) for x in Config.flipped_labels])
 
 
 class Options:
     new = False
+    perft_depth = 3
+    perft_fen = None
+    perft_divide = False
+    tablebase_signatures = None
+    book_depth = 20
 
 
 class ResourceConfig:
@@ -174,12 +195,15 @@ class ResourceConfig:
         self.play_data_dir = os.path.join(self.data_dir, "play_data")
         self.play_data_filename_tmpl = "play_%s.json"
 
+        self.tablebase_dir = os.path.join(self.data_dir, "tablebase")
+        self.opening_book_path = os.path.join(self.data_dir, "opening_book.npz")
+
         self.log_dir = os.path.join(self.project_dir, "logs")
         self.main_log_path = os.path.join(self.log_dir, "main.log")
 
     def create_directories(self):
         dirs = [self.project_dir, self.data_dir, self.model_dir, self.play_data_dir, self.log_dir,
-                self.next_generation_model_dir]
+                self.next_generation_model_dir, self.tablebase_dir]
         for d in dirs:
             if not os.path.exists(d):
                 os.makedirs(d)
@@ -38,6 +38,14 @@ class PlayConfig:
         self.resign_threshold = -0.8
         self.min_resign_turn = 30
         self.max_game_length = 300
+        self.use_tablebase = False  # adjudicate and score leaves from data/tablebase
+        # (tables score every cycle as a draw, also those the env would lose by perpetual check/chase)
+        self.book_depth = 0  # play the first book_depth halfmoves from data/opening_book.npz, 0 to search
+        self.book_diversity = 1.0  # sampling temperature over book weights, 0 picks the most played move
+        self.reuse_tree = True  # keep the searched subtree under the new position between moves
+        self.search_mode = "threads"  # or "batched": one thread, leaf_batch_size leaves per prediction
+        self.leaf_batch_size = 8
+        self.batch_games = 16  # games the 'batch_self' worker plays at once, their leaves share one prediction
 
 
 class TrainerConfig:
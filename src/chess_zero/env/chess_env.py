@@ -110,10 +110,57 @@ def canon_input_planes(fen):
     return all_input_planes(fen)
 
 
+# 批量解码FEN用的查找表：按字符查平面序号（空格为-1）和子力分值
+_PLANE_LOOKUP = np.full(256, -1, dtype=np.int8)
+_VALUE_LOOKUP = np.zeros(256, dtype=np.float32)
+for _piece, _value in {'K': 3, 'A': 2, 'E': 3.25, 'H': 4, 'R': 5, 'C': 4, 'P': 1}.items():
+    _PLANE_LOOKUP[ord(_piece)], _PLANE_LOOKUP[ord(_piece.lower())] = ind[_piece], ind[_piece.lower()]
+    _VALUE_LOOKUP[ord(_piece)], _VALUE_LOOKUP[ord(_piece.lower())] = _value, -_value
+
+
+def canon_input_planes_batch(fens):
+    """
+    一次解码多个FEN，结果与逐个调用下列函数相同：
+
+    * planes: (N, 14, 10, 9) float32，同 :func:`canon_input_planes`
+    * black: (N,) bool，同 :func:`is_black_turn`，为True时策略需要翻转
+    * move_numbers: (N,) int32，FEN的回合数
+    * scores: (N,) float32，同 ``testeval(fen, absolute=False)``
+    """
+    fields = [fen.split(' ') for fen in fens]
+    n = len(fields)
+    # 在拼接后的整个字符串上展开数字，每个局面正好90个字符
+    squares = "".join([f[0] for f in fields]).replace('/', '')
+    for i in range(9, 1, -1):
+        squares = squares.replace(str(i), '1' * i)
+    chars = np.frombuffer(squares.encode('ascii'), dtype=np.uint8).reshape(n, 90)
+    black = np.array([f[1] == 'b' for f in fields], dtype=bool)
+    move_numbers = np.array([int(f[5]) for f in fields], dtype=np.int32)
+
+    values = _VALUE_LOOKUP[chars]
+    scores = values.sum(axis=1) / np.abs(values).sum(axis=1)
+    scores = np.tanh(np.where(black, -scores, scores) * 3).astype(np.float32)
+
+    # 黑方走棋时同maybe_flip_fen：行序颠倒、双方互换（平面序号错开7）
+    plane_index = _PLANE_LOOKUP[chars].reshape(n, 10, 9)
+    flipped = plane_index[black][:, ::-1, :]
+    plane_index[black] = np.where(flipped >= 0, (flipped + 7) % 14, -1)
+    plane_index = plane_index.reshape(n, 90)
+
+    rows, cols = np.nonzero(plane_index >= 0)
+    planes = np.zeros((n, 14, 90), dtype=np.float32)
+    planes[rows, plane_index[rows, cols], cols] = 1
+    return planes.reshape(n, 14, 10, 9), black, move_numbers, scores
+
+
 class ChineseChessEnv:
 
-    def __init__(self):
+    def __init__(self, tablebase=None):
+        """
+        :param chess_zero.lib.tablebase.Tablebase tablebase: 设置后，走子后局面在残局库里时立即判定结果
+        """
         self.board = None
+        self.tablebase = tablebase
         self.num_halfmoves = 0
         self.winner = None  # type: Winner
         self.resigned = False
@@ -155,11 +202,55 @@ class ChineseChessEnv:
             return
 
         self.board.push_ucci(action)
+        self._after_step(check_over)
 
+    def step_move(self, move: chinese_chess.Move, check_over=True):
+        """
+        Same as :func:`step` for a move already known to be legal, e.g. one
+        taken from the board's legal move list; skips UCCI parsing and validation.
+        """
+        self.board.push(move)
+        self._after_step(check_over)
+
+    def _after_step(self, check_over):
         self.num_halfmoves += 1
 
-        if check_over and self.board.result(claim_draw=True) != "*":
-            self._game_over()
+        if check_over:
+            if self.board.result(claim_draw=True) != "*":
+                self._game_over()
+            elif self.tablebase is not None:
+                self._probe_tablebase()
+
+    def _probe_tablebase(self):
+        """
+        按残局库的取值判定结果：0为和棋，否则按走棋方的胜负。
+        残局库不区分长将、长捉，循环局面一律判和（见 :meth:`Tablebase.probe`）。
+        """
+        value = self.tablebase.probe(self.board)
+        if value is None:
+            return
+        if value == 0:
+            self.ending_average_game()
+        elif (value > 0) == self.white_to_move:
+            self.winner = Winner.white
+            self.result = "1-0"
+        else:
+            self.winner = Winner.black
+            self.result = "0-1"
+
+    def undo(self):
+        """
+        Takes back the last :func:`step`, restoring the board from its stack
+        instead of copying the environment.
+
+        Moves are only stepped while the game is running, so the position
+        before the step is always undecided.
+        """
+        self.board.pop()
+        self.num_halfmoves -= 1
+        self.winner = None
+        self.resigned = False
+        self.result = None
 
     def _game_over(self):
         if self.winner is None:
@@ -198,7 +289,8 @@ class ChineseChessEnv:
 
     def copy(self):
         env = copy.copy(self)
-        env.board = copy.copy(self.board)
+        if self.board is not None:
+            env.board = self.board.copy()
         return env
 
     def render(self):
@@ -217,17 +309,17 @@ class ChineseChessEnv:
             fee = self.board.fen()
             self.board.pop()
             if fee == fen_next:
-                return mov.uci()
+                return mov.ucci()
         return None
 
     def replace_tags(self):
         return replace_tags_board(self.board.fen())
 
     def canonical_input_planes(self):
-        return canon_input_planes(self.board.fen())
+        return self.board.canonical_input_planes()
 
     def testeval(self, absolute=False) -> float:
-        return testeval(self.board.fen(), absolute)
+        return self.board.evaluate(absolute)
 
 
 def testeval(fen, absolute=False) -> float:
@@ -1,8 +1,10 @@
 import json
 import os
+from datetime import datetime
 from glob import glob
 import fnmatch
 from logging import getLogger
+from threading import Thread
 
 from chess_zero.config import ResourceConfig
 
@@ -39,6 +41,25 @@ def read_game_data_from_file(path):
     with open(path, "rt") as f:
         return json.load(f)
 
+
+def save_play_data(rc: ResourceConfig, data):
+    """
+    Writes data to a new timestamped play data file in a background thread.
+    """
+    game_id = datetime.now().strftime("%Y%m%d-%H%M%S.%f")
+    path = os.path.join(rc.play_data_dir, rc.play_data_filename_tmpl % game_id)
+    logger.info(f"save play data to {path}")
+    thread = Thread(target=write_game_data_to_file, args=(path, data))
+    thread.start()
+
+
+def remove_old_play_data(rc: ResourceConfig, max_file_num):
+    files = get_game_data_filenames(rc)
+    if len(files) < max_file_num:
+        return
+    for i in range(len(files) - max_file_num):
+        os.remove(files[i])
+
 class GameDataFileWatcher:
     def __init__(self, rc):
         self.resource_config = rc.resource
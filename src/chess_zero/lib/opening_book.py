@@ -0,0 +1,132 @@
+"""
+Opening book aggregated from the visit count policies stored in play data
+"""
+import os
+from collections import defaultdict
+from functools import lru_cache
+from logging import getLogger
+
+import numpy as np
+
+from chess_zero.agent import chinese_chess
+from chess_zero.config import Config
+from chess_zero.lib.data_helper import get_game_data_filenames, read_game_data_from_file
+
+logger = getLogger(__name__)
+
+# 开局库文件（npz）的内容：
+#   keys: (K,) uint64，局面的Zobrist哈希，升序
+#   offsets: (K + 1,) int64，第i个局面的走法是moves[offsets[i]:offsets[i + 1]]
+#   moves: (M,) int16，走法编码（见chinese_chess.Move.code）
+#   weights: (M,) float32，各盘棋在该局面的策略（访问次数分布）之和
+
+
+def fen_ply(fen):
+    """FEN对应的半回合数，开局为0。"""
+    fields = fen.split(' ')
+    return (int(fields[5]) - 1) * 2 + (fields[1] == 'b')
+
+
+def build_book(filenames, depth):
+    """
+    汇总 *filenames* 里前 *depth* 个半回合的局面，同一局面（按Zobrist哈希）的策略相加。
+    :return: (keys, offsets, moves, weights)，见模块说明
+    """
+    totals = defaultdict(lambda: np.zeros(Config.n_labels, dtype=np.float64))
+    for filename in filenames:
+        for fen, policy, _ in read_game_data_from_file(filename):
+            if fen_ply(fen) >= depth:
+                continue
+            totals[chinese_chess.Board(fen).zobrist_hash()] += policy
+
+    # labels下标 -> 走法编码
+    codes = np.flatnonzero(Config.move_index >= 0)
+    label_codes = np.empty(Config.n_labels, dtype=np.int64)
+    label_codes[Config.move_index[codes]] = codes
+    keys = np.array(sorted(totals), dtype=np.uint64)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    moves, weights = [], []
+    for i, key in enumerate(keys.tolist()):
+        labels = np.flatnonzero(totals[key])
+        moves.append(label_codes[labels])
+        weights.append(totals[key][labels])
+        offsets[i + 1] = offsets[i] + len(labels)
+    moves = np.concatenate(moves or [[]]).astype(np.int16)
+    weights = np.concatenate(weights or [[]]).astype(np.float32)
+    return keys, offsets, moves, weights
+
+
+class OpeningBook:
+    """
+    按局面的Zobrist哈希二分查找的开局库。
+    """
+
+    def __init__(self, keys, offsets, moves, weights):
+        self.keys = keys
+        self.offsets = offsets
+        self.moves = moves
+        self.weights = weights
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["keys"], data["offsets"], data["moves"], data["weights"])
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, offsets=self.offsets, moves=self.moves, weights=self.weights)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def probe(self, board):
+        """
+        :return: (走法编码, 权重) 两个数组；局面不在库里时返回None
+        """
+        key = np.uint64(board.zobrist_hash())
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.moves[start:end], self.weights[start:end]
+
+    def choose(self, board, diversity=1.0):
+        """
+        从库里为 *board* 选一步走法：权重取 1 / *diversity* 次方后按比例抽样，*diversity* 为0时取权重最大的走法。
+        :return: chinese_chess.Move；局面不在库里时返回None
+        """
+        entry = self.probe(board)
+        if entry is None:
+            return None
+        codes, weights = entry
+        legal = np.array([board.is_legal(chinese_chess.Move.from_code(int(code))) for code in codes])
+        if not legal.any():
+            return None  # 哈希冲突
+        codes, weights = codes[legal], weights[legal].astype(np.float64)
+        if diversity <= 0:
+            code = codes[np.argmax(weights)]
+        else:
+            p = np.power(weights / weights.max(), 1 / diversity)
+            code = np.random.choice(codes, p=p / p.sum())
+        return chinese_chess.Move.from_code(int(code))
+
+
+@lru_cache(maxsize=None)
+def _load_cached(path):
+    return OpeningBook.load(path)
+
+
+def load_opening_book(config: Config, play_config=None):
+    """按PlayConfig.book_depth返回开局库；未启用或还没有生成时返回None。"""
+    play_config = play_config or config.play
+    path = config.resource.opening_book_path
+    if getattr(play_config, "book_depth", 0) <= 0 or not os.path.exists(path):
+        return None
+    return _load_cached(path)
+
+
+def start(config: Config):
+    filenames = get_game_data_filenames(config.resource)
+    book = OpeningBook(*build_book(filenames, config.opts.book_depth))
+    book.save(config.resource.opening_book_path)
+    print(f"opening book with {len(book)} positions from {len(filenames)} files "
+          f"saved to {config.resource.opening_book_path}")
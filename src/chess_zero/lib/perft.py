@@ -0,0 +1,65 @@
+"""
+Perft suite and divide tool for the chinese_chess move generator
+"""
+from logging import getLogger
+from time import time
+
+from chess_zero.agent.chinese_chess import Board
+from chess_zero.config import Config
+
+logger = getLogger(__name__)
+
+# 节点数按本项目的规则统计：只禁止将帅对面，不检查送将，被吃掉将帅的一方没有后续走法。
+# 因此从第二层开始与通常的象棋perft数值不同。
+PERFT_SUITE = [
+    ("rheakaehr/9/1c5c1/p1p1p1p1p/9/9/P1P1P1P1P/1C5C1/9/RHEAKAEHR w - - 0 1", [44, 1926, 80288, 3343036]),
+    ("r1eakaeh1/9/1ch4cr/p1p1p3p/6p2/9/P1P1P1P1P/1C2C1H2/9/RHEAKAER1 w - - 0 4", [37, 1369, 52424, 2001275]),
+    ("rhe1kae1r/4C4/6h2/2p1p1p1p/p8/P8/2P1P1PcP/1c2E2C1/9/RHEAKA1HR b - - 0 7", [42, 1499, 62441, 2296332]),
+    ("3Ck3r/4a4/e3P4/5r3/P1PcP2R1/8H/9/2c6/4A4/3K2E2 b - - 10 83", [54, 2179, 110767, 4371091]),
+    ("9/4akr2/e2a1P3/9/1C2p2h1/9/9/3p5/5K3/1HCA1AE2 b - - 15 97", [27, 765, 19942, 597194]),
+    ("4k4/9/9/9/9/4R4/9/9/9/4K4 w - - 0 1", [11, 27, 429, 837]),
+    ("3ak4/4a4/4e4/9/2h6/9/9/4C4/4A4/3K5 w - - 0 1", [18, 269, 4971, 68025]),
+]
+
+
+def start(config: Config):
+    depth = config.opts.perft_depth
+    if config.opts.perft_fen:
+        board = Board(config.opts.perft_fen)
+        if config.opts.perft_divide:
+            for ucci, nodes in sorted(board.divide(depth).items()):
+                print(f"{ucci} {nodes}")
+        nodes, elapsed = timed_perft(board, depth)
+        print(f"perft({depth}) = {nodes} in {elapsed:.2f}s, {nodes / max(elapsed, 1e-9):,.0f} nodes/s")
+        return
+
+    total_nodes, total_time, failed = run_suite(depth)
+    print(f"total {total_nodes} nodes in {total_time:.2f}s, {total_nodes / max(total_time, 1e-9):,.0f} nodes/s")
+    if failed:
+        raise RuntimeError(f"perft mismatch in {failed} position(s)")
+
+
+def timed_perft(board, depth) -> (int, float):
+    start_time = time()
+    nodes = board.perft(depth)
+    return nodes, time() - start_time
+
+
+def run_suite(depth) -> (int, float, int):
+    """
+    Runs every suite position up to *depth* (or as deep as its known counts go)
+    and checks the node counts.
+    :return: total nodes, total seconds, number of mismatching positions
+    """
+    total_nodes, total_time, failed = 0, 0.0, 0
+    for fen, counts in PERFT_SUITE:
+        d = min(depth, len(counts))
+        nodes, elapsed = timed_perft(Board(fen), d)
+        total_nodes += nodes
+        total_time += elapsed
+        ok = nodes == counts[d - 1]
+        if not ok:
+            failed += 1
+            logger.error(f"perft({d}) of {fen}: got {nodes}, expected {counts[d - 1]}")
+        print(f"{'ok ' if ok else 'BAD'} perft({d}) = {nodes:9} {elapsed:6.2f}s  {fen}")
+    return total_nodes, total_time, failed
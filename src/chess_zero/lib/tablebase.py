@@ -0,0 +1,313 @@
+"""
+Endgame tablebases for small piece sets, built by retrograde analysis over chinese_chess.Board
+"""
+import os
+from itertools import product
+from logging import getLogger
+from time import time
+
+import numpy as np
+
+from chess_zero.agent import chinese_chess as cc
+from chess_zero.config import Config
+
+logger = getLogger(__name__)
+
+# 残局库的取值（int16，按走棋方）：n > 0 表示n步（半回合）内吃掉对方将帅，n < 0 表示n步内被吃，0为和棋。
+# 规则与Board相同：吃将获胜、无子可走判和；循环局面按和棋处理（不区分长将、长捉），也不计150步限制。
+
+DEFAULT_SIGNATURES = ["KRk", "KHk", "KCk", "KPk", "KRka", "KRke", "KHka", "KCka", "KPka"]
+
+# 签名里的兵种顺序，白方大写在前、黑方小写在后，如 "KRka"
+SIGNATURE_ORDER = [cc.KING, cc.ROOK, cc.HORSE, cc.CANNON, cc.ADVISOR, cc.ELEPHANT, cc.PAWN]
+_ATTACKING_PIECES = {cc.ROOK, cc.HORSE, cc.CANNON, cc.PAWN}
+
+
+def _flip_square(square):
+    return (9 - square // 9) * 9 + square % 9
+
+
+def _domain(color, piece_type):
+    """color方的piece_type可能出现的格子：将帅、士、象限定在本方的位置，兵不会后退。"""
+    if piece_type == cc.KING:
+        squares = [sq for sq in cc.SQUARES if cc._king_white_limit(sq)]
+    elif piece_type == cc.ADVISOR:
+        squares = [sq for sq in cc.SQUARES if cc._advisor_white_limit(sq)]
+    elif piece_type == cc.ELEPHANT:
+        squares = [sq for sq in cc.SQUARES if cc._elephant_white_limit(sq)]
+    elif piece_type == cc.PAWN:
+        squares = [sq for sq in cc.SQUARES if cc._pawn_white_limit(sq) and sq >= 27]
+    else:
+        return list(cc.SQUARES)
+    return squares if color == cc.WHITE else sorted(_flip_square(sq) for sq in squares)
+
+
+def parse_signature(signature):
+    """把 "KRka" 解析成 [(color, piece_type), ...]，按签名顺序排列。"""
+    pieces = []
+    for symbol in signature:
+        color = cc.WHITE if symbol.isupper() else cc.BLACK
+        pieces.append((color, cc.PIECE_SYMBOLS.index(symbol.lower())))
+    return pieces
+
+
+def _signature(placement):
+    """由 [(color, piece_type, square), ...] 得到规范顺序的签名。"""
+    builder = []
+    for color in (cc.WHITE, cc.BLACK):
+        for piece_type in SIGNATURE_ORDER:
+            count = sum(1 for c, t, _ in placement if c == color and t == piece_type)
+            symbol = cc.PIECE_SYMBOLS[piece_type]
+            builder.append((symbol.upper() if color == cc.WHITE else symbol) * count)
+    return "".join(builder)
+
+
+def _mirror(placement):
+    """上下翻转棋盘并交换双方，走棋方随之交换，结果的取值不变。"""
+    return [(not color, piece_type, _flip_square(square)) for color, piece_type, square in placement]
+
+
+def _placement(board):
+    placement = []
+    for square in cc.scan_reversed(board.occupied):
+        color = bool(board.occupied_co[cc.WHITE] & cc.BB_SQUARES[square])
+        placement.append((color, board.piece_type_at(square), square))
+    return placement
+
+
+class _Layout(object):
+    """
+    一个签名的下标方式：每个棋子在各自可能格子里的序号按混合进制排列，最低位是走棋方（白方为1）。
+    """
+
+    def __init__(self, signature):
+        self.signature = signature
+        self.pieces = parse_signature(signature)
+        self.domains = [_domain(color, piece_type) for color, piece_type in self.pieces]
+        self.positions = [{square: i for i, square in enumerate(domain)} for domain in self.domains]
+        self.strides = [2 * int(np.prod([len(d) for d in self.domains[:i]], dtype=np.int64))
+                        for i in range(len(self.domains))]
+        self.size = 2 * int(np.prod([len(d) for d in self.domains], dtype=np.int64))
+
+    def index(self, placement, turn):
+        """placement须与签名一致；有棋子不在其可能的格子上时返回None。"""
+        index = int(turn)
+        used = [False] * len(self.pieces)
+        for color, piece_type, square in placement:
+            for i, piece in enumerate(self.pieces):
+                if not used[i] and piece == (color, piece_type) and square in self.positions[i]:
+                    used[i] = True
+                    index += self.strides[i] * self.positions[i][square]
+                    break
+            else:
+                return None
+        return index
+
+
+class Tablebase(object):
+    """
+    残局库的查询：每个签名一个 ``<signature>.npy`` 文件，按需以内存映射方式打开。
+
+    *tables* 可以直接传入已在内存中的表（生成时使用）。
+    """
+
+    def __init__(self, directory=None, tables=None):
+        self.directory = directory
+        self._tables = dict(tables or {})
+        self._layouts = {}
+        self.max_pieces = max([len(s) for s in self._tables] + [len(s) for s in self._stored_signatures()] + [0])
+
+    def _stored_signatures(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        return [name[:-4] for name in os.listdir(self.directory) if name.endswith(".npy")]
+
+    def _table(self, signature):
+        if signature not in self._tables:
+            path = os.path.join(self.directory, signature + ".npy") if self.directory else None
+            self._tables[signature] = np.load(path, mmap_mode="r") if path and os.path.exists(path) else None
+        return self._tables[signature]
+
+    def layout(self, signature):
+        if signature not in self._layouts:
+            self._layouts[signature] = _Layout(signature)
+        return self._layouts[signature]
+
+    def lookup(self, placement, turn):
+        """
+        查询 [(color, piece_type, square), ...] 在 *turn* 走棋时的取值（按走棋方），
+        双方都没有能过河的棋子时为0；库里没有时返回None。
+        """
+        if not any(piece_type in _ATTACKING_PIECES for _, piece_type, _ in placement):
+            return 0
+        for candidate, candidate_turn in ((placement, turn), (_mirror(placement), not turn)):
+            signature = _signature(candidate)
+            table = self._table(signature)
+            if table is not None:
+                index = self.layout(signature).index(candidate, candidate_turn)
+                if index is not None:
+                    return int(table[index])
+        return None
+
+    def probe(self, board):
+        """
+        查询 *board* 的取值（按走棋方）：n > 0 为n步内获胜，n < 0 为n步内失败，0为和棋；
+        不在残局库里时返回None。
+
+        残局库把循环局面都算作和棋：按Board的重复局面规则会因长将、长捉判负的局面，这里也可能返回0。
+        """
+        if bin(board.occupied).count("1") > self.max_pieces:
+            return None
+        if board.king(cc.WHITE) is None or board.king(cc.BLACK) is None:
+            return None
+        return self.lookup(_placement(board), board.turn)
+
+
+def _sub_signatures(signature):
+    """吃掉一个非将帅棋子后的签名（不含判和的子力组合）。"""
+    pieces = parse_signature(signature)
+    subs = set()
+    for i, (_, piece_type) in enumerate(pieces):
+        if piece_type == cc.KING:
+            continue
+        rest = pieces[:i] + pieces[i + 1:]
+        if any(t in _ATTACKING_PIECES for _, t in rest):
+            subs.add(_signature([(color, t, 0) for color, t in rest]))
+    return sorted(subs)
+
+
+def build(signature, tablebase):
+    """
+    用逆向分析生成 *signature* 的残局库。吃子后得到的更小的子力组合须已在 *tablebase* 中。
+
+    先用Board生成每个局面的全部走法：吃将为一步获胜；吃掉其他棋子后的局面到 *tablebase*
+    里查询；其余走法连到同一张表里的子局面。然后按步数从小到大逐层确定胜负，
+    剩下的局面都是和棋。
+    """
+    layout = _Layout(signature)
+    n = layout.size
+    value = np.zeros(n, dtype=np.int16)
+    done = np.zeros(n, dtype=bool)
+    remaining = np.zeros(n, dtype=np.int32)  # 还不知道是对方获胜的走法数
+    loss_depth = np.zeros(n, dtype=np.int32)  # 已知对方获胜的走法里最长的步数
+    buckets = {}  # 步数 -> 候选局面，正数为获胜、负数为失败
+    edges = []
+
+    def push(depth, index):
+        buckets.setdefault(abs(depth), []).append((depth, index))
+
+    board = cc.Board(None)
+    for squares in product(*layout.domains):
+        if len(set(squares)) < len(squares):
+            continue
+        base = sum(stride * positions[sq] for stride, positions, sq in zip(layout.strides, layout.positions, squares))
+        board.clear_board()
+        for (color, piece_type), square in zip(layout.pieces, squares):
+            board._set_piece_at(square, piece_type, color)
+        owner = {square: i for i, square in enumerate(squares)}
+
+        for turn in (cc.WHITE, cc.BLACK):
+            board.turn = turn
+            index = base + int(turn)
+            codes = board.generate_legal_move_codes()
+            if not codes:
+                done[index] = True  # 无子可走，和棋
+                continue
+            for code in codes:
+                from_square, to_square = divmod(code, 90)
+                i = owner[from_square]
+                if to_square in owner:
+                    captured = layout.pieces[owner[to_square]][1]
+                    if captured == cc.KING:
+                        push(1, index)
+                        continue
+                    placement = [(color, piece_type, to_square if j == i else square)
+                                 for j, ((color, piece_type), square) in enumerate(zip(layout.pieces, squares))
+                                 if square != to_square]
+                    child = tablebase.lookup(placement, not turn)
+                    if child is None:
+                        raise ValueError(f"tablebase {_signature(placement)} is needed to build {signature}")
+                    if child < 0:
+                        push(1 - child, index)
+                    elif child > 0:
+                        loss_depth[index] = max(loss_depth[index], child)
+                    else:
+                        remaining[index] += 1  # 和棋的走法，永远不会被减掉
+                else:
+                    child = base + layout.strides[i] * (layout.positions[i][to_square] - layout.positions[i][from_square])
+                    edges.append((child + int(not turn), index))
+                    remaining[index] += 1
+            if not remaining[index]:
+                push(-(loss_depth[index] + 1), index)
+
+    # 反向边：子局面 -> 父局面
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    order = np.argsort(edges[:, 0], kind="stable")
+    parents = edges[order, 1]
+    starts = np.searchsorted(edges[order, 0], np.arange(n + 1))
+
+    depth = 1
+    while buckets:
+        for signed, index in buckets.pop(depth, []):
+            if done[index]:
+                continue
+            done[index] = True
+            value[index] = signed
+            for parent in parents[starts[index]:starts[index + 1]]:
+                if done[parent]:
+                    continue
+                if signed < 0:
+                    push(depth + 1, parent)
+                else:
+                    remaining[parent] -= 1
+                    loss_depth[parent] = max(loss_depth[parent], depth)
+                    if not remaining[parent]:
+                        push(-(loss_depth[parent] + 1), parent)
+        depth += 1
+    return value
+
+
+def build_all(signatures, directory=None):
+    """
+    依次生成 *signatures* 及其依赖的更小的残局库，*directory* 不为None时保存为 ``<signature>.npy``。
+    :return: 包含全部已生成残局库的 :class:`Tablebase`
+    """
+    tablebase = Tablebase(directory)
+
+    def ensure(signature):
+        placement = [(color, piece_type, 0) for color, piece_type in parse_signature(signature)]
+        if tablebase._table(signature) is not None or \
+                tablebase._table(_signature(_mirror(placement))) is not None:
+            return  # 已生成或已保存在directory里
+        for sub in _sub_signatures(signature):
+            ensure(sub)
+        start_time = time()
+        table = build(signature, tablebase)
+        tablebase._tables[signature] = table
+        tablebase.max_pieces = max(tablebase.max_pieces, len(signature))
+        logger.info(f"tablebase {signature}: {len(table)} positions, "
+                    f"{np.count_nonzero(table > 0)} wins, {np.count_nonzero(table < 0)} losses "
+                    f"in {time() - start_time:.1f}s")
+        if directory is not None:
+            np.save(os.path.join(directory, signature + ".npy"), table)
+
+    for signature in signatures:
+        ensure(signature)
+    return tablebase
+
+
+def load_tablebase(config: Config, play_config=None):
+    """按PlayConfig.use_tablebase返回残局库，未启用时返回None。"""
+    play_config = play_config or config.play
+    if not getattr(play_config, "use_tablebase", False):
+        return None
+    return Tablebase(config.resource.tablebase_dir)
+
+
+def start(config: Config):
+    signatures = config.opts.tablebase_signatures or DEFAULT_SIGNATURES
+    directory = config.resource.tablebase_dir
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    build_all(signatures, directory)
+    print(f"tablebases saved to {directory}")
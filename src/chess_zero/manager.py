@@ -7,7 +7,7 @@ from .config import Config
 
 logger = getLogger(__name__)
 
-CMD_LIST = ['self', 'opt', 'eval', 'play_gui', 'sl', 'uci']
+CMD_LIST = ['self', 'opt', 'eval', 'play_gui', 'sl', 'uci', 'perft', 'tablebase', 'book', 'bench_search', 'batch_self']
 
 
 def create_parser():
@@ -16,11 +16,22 @@ def create_parser():
     parser.add_argument("--new", help="run from new best model", action="store_true")
     parser.add_argument("--type", help="use normal setting", default="normal")
     parser.add_argument("--total-step", help="set TrainerConfig.start_total_steps", type=int)
+    parser.add_argument("--depth", help="perft depth", type=int, default=3)
+    parser.add_argument("--fen", help="perft a single position instead of the suite")
+    parser.add_argument("--divide", help="print perft node counts per first move", action="store_true")
+    parser.add_argument("--signatures", help="comma separated tablebase signatures, e.g. KRk,KHka")
+    parser.add_argument("--book-depth", help="halfmoves to keep in the opening book", type=int, default=20)
     return parser
 
 
 def setup(config: Config, args):
     config.opts.new = args.new
+    config.opts.perft_depth = args.depth
+    config.opts.perft_fen = args.fen
+    config.opts.perft_divide = args.divide
+    config.opts.book_depth = args.book_depth
+    if args.signatures:
+        config.opts.tablebase_signatures = args.signatures.split(",")
     if args.total_step is not None:
         config.trainer.start_total_steps = args.total_step
     config.resource.create_directories()
@@ -58,3 +69,18 @@ def start():
     elif args.cmd == 'uci':
         from .play_game import uci
         return uci.start(config)
+    elif args.cmd == 'perft':
+        from .lib import perft
+        return perft.start(config)
+    elif args.cmd == 'tablebase':
+        from .lib import tablebase
+        return tablebase.start(config)
+    elif args.cmd == 'book':
+        from .lib import opening_book
+        return opening_book.start(config)
+    elif args.cmd == 'bench_search':
+        from .worker import search_bench
+        return search_bench.start(config)
+    elif args.cmd == 'batch_self':
+        from .worker import batch_self_play
+        return batch_self_play.start(config)
@@ -0,0 +1,164 @@
+"""
+Self play that advances many games in one process. Each game runs its own MCTS one batch of
+leaves at a time, and the leaves of all games go to the model together in a single prediction.
+"""
+from logging import getLogger
+from time import time
+
+import numpy as np
+
+from chess_zero.agent.player_chess import ChineseChessPlayer, game_data
+from chess_zero.config import Config
+from chess_zero.env.chess_env import ChineseChessEnv
+from chess_zero.lib.data_helper import remove_old_play_data, save_play_data
+from chess_zero.lib.tablebase import load_tablebase
+
+logger = getLogger(__name__)
+
+
+def start(config: Config):
+    # keras is only needed here, play_games() works with any predict function
+    from chess_zero.agent.model_chess import ChessModel
+    from chess_zero.lib.logger import setup_module_logger
+    from chess_zero.lib.model_helper import load_best_model_weight, save_as_best_model
+
+    setup_module_logger(logger, 'self.log')
+    model = ChessModel(config)
+    if config.opts.new or not load_best_model_weight(model):
+        model.build()
+        save_as_best_model(model)
+    return BatchSelfPlayWorker(config, model).start()
+
+
+class BatchSelfPlayWorker:
+    def __init__(self, config: Config, model):
+        """
+        :param model: the ChessModel whose network evaluates the leaves of every game
+        """
+        self.config = config
+        self.current_model = model
+        self.buffer = []
+
+    def start(self):
+        from chess_zero.lib.model_helper import reload_best_model_weight_if_changed
+
+        for game_idx, (env, data, seconds) in enumerate(
+                play_games(self.config, self.predict, load_tablebase(self.config)), start=1):
+            logger.info(f"game {game_idx:3} time={seconds:5.1f}s "
+                        f"halfmoves={env.num_halfmoves:3} {env.winner:12} "
+                        f"{'by resign ' if env.resigned else '          '}")
+            self.buffer += data
+            if (game_idx % self.config.play_data.nb_game_in_file) == 0:
+                self.flush_buffer()
+                self.remove_play_data()
+                reload_best_model_weight_if_changed(self.current_model)
+
+    def predict(self, state_planes):
+        policy_ary, value_ary = self.current_model.model.predict_on_batch(state_planes)
+        return policy_ary, value_ary.reshape(-1)
+
+    def flush_buffer(self):
+        save_play_data(self.config.resource, self.buffer)
+        self.buffer = []
+
+    def remove_play_data(self):
+        remove_old_play_data(self.config.resource, self.config.play_data.max_file_num)
+
+
+class GameSlot:
+    """
+    One game in progress and the state of the search for its current move.
+    """
+    def __init__(self, config: Config, tablebase=None):
+        self.config = config
+        self.env = ChineseChessEnv(tablebase).reset()
+        self.white = ChineseChessPlayer(config)
+        self.black = ChineseChessPlayer(config)
+        self.search_env = None  # scratch copy of env that the search walks, None between moves
+        self.remaining = 0
+        self.vals = []
+        self.pending = []
+        self.start_time = time()
+
+    @property
+    def player(self) -> ChineseChessPlayer:
+        return self.white if self.env.white_to_move else self.black
+
+    def step(self, action):
+        self.env.step(action)
+        if self.env.num_halfmoves >= self.config.play.max_game_length:
+            self.env.adjudicate()
+
+    def start_move(self):
+        """
+        Plays book moves until the game ends or a move needs a search, then starts that search.
+        """
+        while not self.env.done:
+            action = self.player.book_action(self.env)
+            if action is None:
+                self.player.prepare_search(self.env)
+                self.search_env = self.env.copy()
+                self.remaining = self.config.play.simulation_num_per_move
+                self.vals = []
+                return
+            self.step(action)
+
+    def collect_leaves(self):
+        """
+        Walks the tree until leaf_batch_size leaves are pending, the simulations of this move
+        run out or a walk collides with a pending leaf. Terminal leaves are backed up at once.
+        """
+        player = self.player
+        self.pending = []
+        while self.remaining > 0 and len(self.pending) < self.config.play.leaf_batch_size:
+            path, leaf_v = player.select_leaf(self.search_env, self.pending)
+            if path is None:
+                break  # collision with a pending leaf
+            self.remaining -= 1
+            if leaf_v is not None:
+                self.vals.append(player.backup(path, leaf_v))
+
+    def receive(self, policies, values):
+        player = self.player
+        for (path, node, _), leaf_p, leaf_v in zip(self.pending, policies, values):
+            node.policy = leaf_p
+            self.vals.append(player.backup(path, float(leaf_v)))
+        self.pending = []
+        if self.remaining == 0:
+            self.search_env = None
+            self.step(self.player.choose_action(self.env, np.max(self.vals)))
+
+    def result(self) -> list:
+        """
+        :return: the training data of the finished game, white and black moves interleaved
+        """
+        return game_data(self.env, self.white, self.black)
+
+
+def play_games(config: Config, predict, tablebase=None):
+    """
+    Keeps PlayConfig.batch_games games going. Every round each game collects up to leaf_batch_size
+    leaves, all the leaves are evaluated with one call to predict, and games whose search is complete
+    play their move. A finished game is replaced by a new one.
+    :param predict: (k, 14, 10, 9) canonical input planes -> (k, n_labels) policies and (k,) values
+    :return: generator of (env, data, seconds) for each finished game
+    """
+    games = [GameSlot(config, tablebase) for _ in range(config.play.batch_games)]
+    while True:
+        for idx in range(len(games)):
+            if games[idx].search_env is None:
+                games[idx].start_move()
+            while games[idx].env.done:
+                game = games[idx]
+                yield game.env, game.result(), time() - game.start_time
+                games[idx] = GameSlot(config, tablebase)
+                games[idx].start_move()
+            games[idx].collect_leaves()
+
+        planes = [planes for game in games for _, _, planes in game.pending]
+        policies, values = predict(np.asarray(planes, dtype=np.float32)) if planes else ([], [])
+        start = 0
+        for game in games:
+            end = start + len(game.pending)
+            game.receive(policies[start:end], values[start:end])
+            start = end
@@ -11,6 +11,7 @@ from chess_zero.config import Config
 from chess_zero.env.chess_env import ChineseChessEnv, Winner
 from chess_zero.lib.data_helper import get_next_generation_model_dirs
 from chess_zero.lib.logger import setup_module_logger
+from chess_zero.lib.tablebase import load_tablebase
 from chess_zero.lib.model_helper import (load_best_model_weight,
                                          save_as_best_model)
 
@@ -118,7 +119,7 @@ class EvaluateWorker:
 def play_game(config, cur, ng, current_white: bool) -> (float, ChineseChessEnv, bool):
     cur_pipes = cur.pop()
     ng_pipes = ng.pop()
-    env = ChineseChessEnv().reset()
+    env = ChineseChessEnv(load_tablebase(config, config.eval.play_config)).reset()
 
     current_player = ChineseChessPlayer(config, pipes=cur_pipes, play_config=config.eval.play_config)
     ng_player = ChineseChessPlayer(config, pipes=ng_pipes, play_config=config.eval.play_config)
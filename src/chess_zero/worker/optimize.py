@@ -13,8 +13,7 @@ from keras.optimizers import Adam
 
 from chess_zero.agent.model_chess import ChessModel
 from chess_zero.config import Config
-from chess_zero.env.chess_env import (canon_input_planes, is_black_turn,
-                                      testeval)
+from chess_zero.env.chess_env import canon_input_planes_batch
 from chess_zero.lib.data_helper import (get_game_data_filenames,
                                         get_next_generation_model_dirs,
                                         read_game_data_from_file,
@@ -160,23 +159,12 @@ def convert_to_cheating_data(data):
     :param data: format is SelfPlayWorker.buffer
     :return:
     """
-    state_list = []
-    policy_list = []
-    value_list = []
-    for state_fen, policy, value in data:
+    state_ary, black, move_numbers, scores = canon_input_planes_batch([state_fen for state_fen, _, _ in data])
 
-        state_planes = canon_input_planes(state_fen)
+    policy_ary = np.asarray([policy for _, policy, _ in data], dtype=np.float32).reshape(len(data), Config.n_labels)
+    policy_ary[black] = policy_ary[black][:, Config.unflipped_index]
 
-        if is_black_turn(state_fen):
-            policy = Config.flip_policy(policy)
+    value_certainty = np.minimum(5, move_numbers) / 5  # reduces the noise of the opening... plz train faster
+    value_ary = np.asarray([value for _, _, value in data]) * value_certainty + scores * (1 - value_certainty)
 
-        move_number = int(state_fen.split(' ')[5])
-        value_certainty = min(5, move_number) / 5  # reduces the noise of the opening... plz train faster
-        sl_value = value * value_certainty + testeval(state_fen, False) * (1 - value_certainty)
-
-        state_list.append(state_planes)
-        policy_list.append(policy)
-        value_list.append(sl_value)
-
-    return (np.asarray(state_list, dtype=np.float32), np.asarray(policy_list, dtype=np.float32),
-            np.asarray(value_list, dtype=np.float32))
+    return state_ary, policy_ary, value_ary.astype(np.float32)
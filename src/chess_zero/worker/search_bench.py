@@ -0,0 +1,50 @@
+"""
+Compares the simulations per second of the threaded and the leaf-batched MCTS
+"""
+import copy
+from logging import getLogger
+from time import time
+
+from chess_zero.agent.player_chess import ChineseChessPlayer
+from chess_zero.config import Config
+from chess_zero.env.chess_env import ChineseChessEnv
+
+logger = getLogger(__name__)
+
+# 测速时依次搜索这些走法之前的局面
+BENCH_LINE = ['h2e2', 'h9g7', 'h0g2', 'i9h9', 'i0h0', 'b9c7', 'b2b6', 'c6c5']
+
+
+def start(config: Config):
+    # keras is only needed here, benchmark() works with any pipes
+    from chess_zero.agent.model_chess import ChessModel
+    from chess_zero.lib.model_helper import load_best_model_weight
+
+    model = ChessModel(config)
+    if not load_best_model_weight(model):
+        model.build()
+    pipes = model.get_pipes(config.play.search_threads)
+    for mode, speed in benchmark(config, pipes).items():
+        print(f"{mode:8}: {speed:8.1f} simulations/s")
+
+
+def benchmark(config: Config, pipes, modes=("threads", "batched")):
+    """
+    :param pipes: pipes to the model, at least PlayConfig.search_threads of them
+    :return: {search_mode: simulations per second}
+    """
+    results = {}
+    for mode in modes:
+        play_config = copy.copy(config.play)
+        play_config.search_mode = mode
+        play_config.reuse_tree = False  # every position is searched from an empty tree
+        player = ChineseChessPlayer(config, pipes=pipes, play_config=play_config)
+        env = ChineseChessEnv().reset()
+        start_time = time()
+        for ucci in BENCH_LINE:
+            player.prepare_search(env)
+            player.search_moves(env)
+            env.step(ucci)
+        results[mode] = len(BENCH_LINE) * play_config.simulation_num_per_move / (time() - start_time)
+        logger.info(f"{mode}: {results[mode]:.1f} simulations/s")
+    return results
@@ -1,19 +1,16 @@
-import os
 from collections import deque
 from concurrent.futures import ProcessPoolExecutor
-from datetime import datetime
 from logging import getLogger
 from multiprocessing import Manager
-from threading import Thread
 from time import time
 
 from chess_zero.agent.model_chess import ChessModel
-from chess_zero.agent.player_chess import ChineseChessPlayer
+from chess_zero.agent.player_chess import ChineseChessPlayer, game_data
 from chess_zero.config import Config
-from chess_zero.env.chess_env import ChineseChessEnv, Winner
-from chess_zero.lib.data_helper import (get_game_data_filenames,  # , pretty_print
-                                        write_game_data_to_file)
+from chess_zero.env.chess_env import ChineseChessEnv
+from chess_zero.lib.data_helper import remove_old_play_data, save_play_data  # , pretty_print
 from chess_zero.lib.logger import setup_module_logger
+from chess_zero.lib.tablebase import load_tablebase
 from chess_zero.lib.model_helper import (load_best_model_weight,
                                          reload_best_model_weight_if_changed,
                                          save_as_best_model)
@@ -74,25 +71,16 @@ class SelfPlayWorker:
         return model
 
     def flush_buffer(self):
-        rc = self.config.resource
-        game_id = datetime.now().strftime("%Y%m%d-%H%M%S.%f")
-        path = os.path.join(rc.play_data_dir, rc.play_data_filename_tmpl % game_id)
-        logger.info(f"save play data to {path}")
-        thread = Thread(target=write_game_data_to_file, args=(path, self.buffer))
-        thread.start()
+        save_play_data(self.config.resource, self.buffer)
         self.buffer = []
 
     def remove_play_data(self):
-        files = get_game_data_filenames(self.config.resource)
-        if len(files) < self.config.play_data.max_file_num:
-            return
-        for i in range(len(files) - self.config.play_data.max_file_num):
-            os.remove(files[i])
+        remove_old_play_data(self.config.resource, self.config.play_data.max_file_num)
 
 
 def self_play_buffer(config, cur) -> (ChineseChessPlayer, list):
     pipes = cur.pop()  # borrow
-    env = ChineseChessEnv().reset()
+    env = ChineseChessEnv(load_tablebase(config)).reset()
 
     white = ChineseChessPlayer(config, pipes=pipes)
     black = ChineseChessPlayer(config, pipes=pipes)
@@ -112,21 +100,7 @@ def self_play_buffer(config, cur) -> (ChineseChessPlayer, list):
         if env.num_halfmoves >= config.play.max_game_length:
             env.adjudicate()
 
-    if env.winner == Winner.white:
-        black_win = -1
-    elif env.winner == Winner.black:
-        black_win = 1
-    else:
-        black_win = 0
-
-    black.finish_game(black_win)
-    white.finish_game(-black_win)
-
-    data = []
-    for i in range(len(white.moves)):
-        data.append(white.moves[i])
-        if i < len(black.moves):
-            data.append(black.moves[i])
+    data = game_data(env, white, black)
 
     cur.append(pipes)
     return env, data
@@ -1,6 +1,11 @@
+import os
+import pickle
+import tempfile
 import unittest
 
-from chess_zero.agent.chinese_chess import Board
+from chess_zero.agent import chinese_chess
+from chess_zero.agent.chinese_chess import Board, Move, WHITE, BLACK
+from chess_zero.env import chess_env
 
 
 def replace_chess(fen):
@@ -101,6 +106,22 @@ class BoardUnitTest(unittest.TestCase):
             result_set.add(step.ucci())
         self.assertEqual(correct_set, result_set)
 
+    def test_cannon_capture(self):
+        """
+        测试炮隔子吃子，以及炮将军的判断。
+        :return:
+        """
+        fen = '4k4/9/9/9/4p4/9/9/4C1p2/9/3K5 w - - 0 1'
+        board = Board(fen)
+        captures = {m.ucci() for m in board.generate_legal_moves() if board.is_capture(m)}
+        self.assertEqual({'e2e9'}, captures)
+        self.assertFalse(board.is_legal(Move.from_ucci('e2e5')))
+        self.assertFalse(board.is_legal(Move.from_ucci('e2g2')))
+        self.assertTrue(board.is_legal(Move.from_ucci('e2f2')))
+
+        board.turn = not board.turn
+        self.assertTrue(board.is_check())
+
     def test_horse(self):
         fen = '9/9/9/9/5p3/9/3RN4/4p1P2/9/9 w - - 0 1'
         fen = replace_chess(fen)
@@ -113,6 +134,19 @@ class BoardUnitTest(unittest.TestCase):
             result_set.add(step.ucci())
         self.assertEqual(correct_set, result_set)
 
+    def test_horse_check(self):
+        """
+        测试马将军的判断，以及蹩马腿时不算将军。
+        :return:
+        """
+        board = Board('4k4/9/3H5/9/9/9/9/9/9/4K4 b - - 0 1')
+        self.assertTrue(board.is_check())
+        self.assertEqual(1 << 66, board.attackers_mask(True, 85))
+        board = Board('4k4/9/3HP4/9/9/9/9/9/9/4K4 b - - 0 1')
+        self.assertTrue(board.is_check())
+        board = Board('4k4/3P5/3H5/9/9/9/9/9/9/4K4 b - - 0 1')
+        self.assertFalse(board.is_check())
+
     def test_elephant(self):
         fen = '9/9/9/9/9/9/9/4B4/3K1p3/9 w - - 0 1'
         fen = replace_chess(fen)
@@ -164,5 +198,243 @@ class BoardUnitTest(unittest.TestCase):
             result_set.add(step.ucci())
         self.assertEqual(correct_set, result_set)
 
+    def test_zobrist_incremental(self):
+        """
+        测试push增量更新的Zobrist哈希与从头计算的结果一致。
+        :return:
+        """
+        board = Board()
+        for ucci in ['h2e2', 'h9g7', 'e2e6', 'i9h9', 'e6a6']:
+            board.push(Move.from_ucci(ucci))
+            self.assertEqual(board._board_zobrist(), board._zobrist)
+            self.assertEqual(Board(board.fen()).zobrist_hash(), board.zobrist_hash())
+
+    def test_zobrist_transposition(self):
+        board1 = Board()
+        board2 = Board()
+        for ucci in ['h2e2', 'h9g7', 'b0c2']:
+            board1.push(Move.from_ucci(ucci))
+        for ucci in ['b0c2', 'h9g7', 'h2e2']:
+            board2.push(Move.from_ucci(ucci))
+        self.assertEqual(board1.zobrist_hash(), board2.zobrist_hash())
+
+        board2.turn = not board2.turn
+        self.assertNotEqual(board1.zobrist_hash(), board2.zobrist_hash())
+
+    def test_push_pop(self):
+        """
+        测试pop能恢复push之前的局面。
+        :return:
+        """
+        board = Board()
+        fens = []
+        for ucci in ['h2e2', 'h9g7', 'e2e6', 'i9h9', 'e6e9']:
+            fens.append((board.fen(), board.zobrist_hash()))
+            board.push(Move.from_ucci(ucci))
+        for ucci in reversed(['h2e2', 'h9g7', 'e2e6', 'i9h9', 'e6e9']):
+            self.assertEqual(ucci, board.pop().ucci())
+            self.assertEqual(fens.pop(), (board.fen(), board.zobrist_hash()))
+        self.assertRaises(IndexError, board.pop)
+
+    def test_king_face_pin(self):
+        """
+        测试两将之间唯一的棋子被牵制，只能在两将之间移动或吃掉对方的将。
+        :return:
+        """
+        fen = '4k4/9/9/9/9/4R4/9/9/9/4K4 w - - 0 1'
+        board = Board(fen)
+        correct_set = {'e4e{0}'.format(i) for i in [0, 1, 2, 3, 5, 6, 7, 8, 9]} - {'e4e0'}
+        correct_set |= {'e0d0', 'e0f0', 'e0e1'}
+        result_set = {m.ucci() for m in board.generate_legal_moves()}
+        self.assertEqual(correct_set, result_set)
+        self.assertEqual(result_set, {m.ucci() for m in board.generate_legal_move_list()})
+        self.assertEqual(len(result_set), board.legal_moves.count())
+        self.assertTrue(board.is_legal(Move.from_ucci('e4e9')))
+        self.assertFalse(board.is_legal(Move.from_ucci('e4d4')))
+
+    def test_copy(self):
+        """
+        测试复制的棋盘与原棋盘互不影响，且可以在副本上pop历史着法。
+        :return:
+        """
+        board = Board()
+        for ucci in ['h2e2', 'h9g7', 'e2e6']:
+            board.push(Move.from_ucci(ucci))
+        fen = board.fen()
+        clone = board.copy()
+        self.assertEqual(fen, clone.fen())
+        self.assertEqual(board.zobrist_hash(), clone.zobrist_hash())
+        clone.push(Move.from_ucci('i9h9'))
+        self.assertEqual('i9h9', clone.pop().ucci())
+        self.assertEqual('e2e6', clone.pop().ucci())
+        self.assertEqual(fen, board.fen())
+        self.assertEqual(3, len(board.move_stack))
+        self.assertEqual(0, len(board.copy(stack=False).move_stack))
+        self.assertFalse(hasattr(board, '__dict__'))
+
+    def test_repetition(self):
+        """
+        测试重复局面：来回走子判和，长将、长捉判负。
+        :return:
+        """
+        def play(fen, uccis):
+            board = Board(fen)
+            for ucci in uccis:
+                self.assertEqual('*', board.result(claim_draw=True))
+                board.push(Move.from_ucci(ucci))
+            return board
+
+        board = play('3k5/9/9/9/9/9/9/9/9/4K2H1 w - - 0 1', ['h0g2', 'd9d8', 'g2h0', 'd8d9'] * 2)
+        self.assertTrue(board.can_claim_threefold_repetition())
+        self.assertEqual('*', board.result())
+        self.assertEqual('1/2-1/2', board.result(claim_draw=True))
+        board.pop()
+        self.assertFalse(board.can_claim_threefold_repetition())
+
+        board = play('4k4/9/R8/9/9/9/9/9/9/3K5 w - - 0 1',
+                     ['a7a9', 'e9e8', 'a9a8', 'e8e9', 'a8a9', 'e9e8', 'a9a8', 'e8e9', 'a8a9'])
+        self.assertEqual('0-1', board.result(claim_draw=True))
+
+        board = play('3k5/9/9/9/h8/9/9/9/1R7/4K4 w - - 0 1', ['b1a1', 'a5b7', 'a1b1', 'b7a5'] * 2)
+        self.assertEqual('0-1', board.result(claim_draw=True))
+
+    def test_legal_cache(self):
+        """
+        测试合法走法缓存：pop恢复上一局面的缓存，直接修改局面后重新生成。
+        :return:
+        """
+        board = Board()
+        codes = board.legal_move_codes()
+        self.assertEqual([m.code() for m in board.generate_legal_moves()], list(codes))
+        board.push(Move.from_ucci('h2e2'))
+        self.assertEqual(sorted(m.code() for m in board.generate_legal_moves()), sorted(board.legal_move_codes()))
+        board.pop()
+        self.assertIs(codes, board.legal_move_codes())
+        self.assertTrue(board.is_legal(Move.from_ucci('h2e2')))
+        self.assertFalse(board.is_legal(Move.from_ucci('h2e3')))
+        board.set_fen('4k4/9/9/9/9/4R4/9/9/9/4K4 w - - 0 1')
+        self.assertFalse(board.is_legal(Move.from_ucci('h2e2')))
+        self.assertEqual(len(list(board.generate_legal_moves())), board.legal_moves.count())
+
+    def test_material(self):
+        """
+        测试增量维护的子力与从FEN计算的testeval一致，pop后恢复。
+        :return:
+        """
+        board = Board()
+        self.assertEqual(44.5, board.material(WHITE))
+        self.assertEqual(44.5, board.material(BLACK))
+        history = []
+        for ucci in ['h2e2', 'h9g7', 'e2e6', 'g7e6', 'e3e4', 'c6c5', 'e4e5']:
+            history.append((board.material(WHITE), board.material(BLACK), board.evaluate(positional=True)))
+            board.push(Move.from_ucci(ucci))
+            for absolute in (True, False):
+                self.assertAlmostEqual(chess_env.testeval(board.fen(), absolute), board.evaluate(absolute))
+        self.assertEqual((40.5, 43.5), (board.material(WHITE), board.material(BLACK)))
+        # 过河兵有位置分
+        self.assertGreater(board.evaluate(True, positional=True), board.evaluate(True))
+        while history:
+            board.pop()
+            self.assertEqual(history.pop(), (board.material(WHITE), board.material(BLACK),
+                                             board.evaluate(positional=True)))
+        self.assertEqual(0.0, board.evaluate())
+
+    def test_insufficient_material(self):
+        """
+        测试双方只剩将、士、象时判和，有能过河的棋子时继续。
+        :return:
+        """
+        board = Board('2eakae2/9/9/9/9/9/9/9/4A4/2E1K4 w - - 0 1')
+        self.assertTrue(board.is_insufficient_material())
+        self.assertTrue(board.is_game_over())
+        self.assertEqual('1/2-1/2', board.result())
+        board = Board('2eakae2/9/9/9/9/9/9/9/4A4/2E1K3P w - - 0 1')
+        self.assertFalse(board.is_insufficient_material())
+        self.assertEqual('*', board.result())
+
+    def test_fen_cache(self):
+        """
+        测试缓存的FEN在走子、悔棋、复制和直接改动棋子后与重新生成的相同。
+        :return:
+        """
+        def uncached(board):
+            board = board.copy()
+            board._fen_rows = [None] * 10
+            board._board_fen = None
+            return board.fen()
+
+        board = Board()
+        fens = [board.fen()]
+        for ucci in ['h2e2', 'h9g7', 'e2e6', 'c6c5', 'e6e9', 'g7e8']:
+            board.push(Move.from_ucci(ucci))
+            self.assertEqual(uncached(board), board.fen())
+            self.assertEqual(board.fen(), Board(board.fen()).fen())
+            fens.append(board.fen())
+        copy = board.copy()
+        copy.pop()
+        self.assertEqual(fens[-1], board.fen())
+        while board.move_stack:
+            fens.pop()
+            board.pop()
+            self.assertEqual(fens[-1], board.fen())
+            self.assertEqual(uncached(board), board.fen())
+        board._remove_piece_at(0)
+        board._set_piece_at(40, chinese_chess.ROOK, WHITE)
+        self.assertEqual('rheakaehr/9/1c5c1/p1p1p1p1p/9/4R4/P1P1P1P1P/1C5C1/9/1HEAKAEHR w - - 0 1', board.fen())
+
+    def test_position(self):
+        """
+        测试Position的导出、还原、哈希和pickle。
+        :return:
+        """
+        board = Board()
+        positions = {}
+        for ucci in ['h2e2', 'h9g7', 'e2e6', 'c6c5', 'e6e9']:
+            position = board.position()
+            positions[position] = board.fen()
+            board.push(Move.from_ucci(ucci))
+        position = board.position()
+        self.assertEqual(board.zobrist_hash(), position.zobrist)
+        self.assertEqual(position, pickle.loads(pickle.dumps(position)))
+
+        restored = Board.from_position(position)
+        self.assertEqual(board.fen(), restored.fen())
+        self.assertEqual(board.legal_move_codes(), restored.legal_move_codes())
+        self.assertEqual(board.evaluate(positional=True), restored.evaluate(positional=True))
+        self.assertEqual([], restored.move_stack)
+        restored.push(Move.from_ucci('g7e8'))
+        restored.pop()
+        self.assertEqual(position, restored.position())
+
+        while board.move_stack:
+            board.pop()
+            self.assertEqual(board.fen(), positions[board.position()])
+        self.assertEqual(board.fen(), Board().position().fen())
+
+        board.set_position(position)
+        self.assertEqual(restored.fen(), board.fen())
+
+    def test_attack_table_cache(self):
+        """
+        测试缓存的攻击表与重新生成的相同，版本不符或损坏的缓存文件被忽略。
+        :return:
+        """
+        self.assertEqual(chinese_chess._rays(), (chinese_chess.BB_RAYS, chinese_chess.BB_BETWEEN))
+        self.assertEqual(chinese_chess._cannon_attack_table([-9, 9]), chinese_chess.BB_CANNON_FILE_ATTACKS)
+        self.assertEqual(chinese_chess._leg_table(chinese_chess.HORSE_JUMPS),
+                         (chinese_chess.BB_HORSE_MASKS, chinese_chess.BB_HORSE_ATTACKS))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'tables.pickle')
+            self.assertEqual({}, chinese_chess._load_attack_tables(path))
+            chinese_chess._save_attack_tables({'rays': [1, 2]}, path)
+            self.assertEqual({'rays': [1, 2]}, chinese_chess._load_attack_tables(path))
+            with open(path, 'wb') as f:
+                pickle.dump((chinese_chess.ATTACK_TABLES_VERSION - 1, {'rays': [1, 2]}), f)
+            self.assertEqual({}, chinese_chess._load_attack_tables(path))
+            with open(path, 'wb') as f:
+                f.write(b'broken')
+            self.assertEqual({}, chinese_chess._load_attack_tables(path))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import random
+
+import numpy as np
+
+from chess_zero.agent.batch_chess import BatchBoard
+from chess_zero.agent.chinese_chess import Board, Move
+from chess_zero.lib.perft import PERFT_SUITE
+
+FENS = [fen for fen, _ in PERFT_SUITE] + [
+    '9/9/9/9/3rP4/9/P1P3P1P/9/9/9 w - - 0 1',
+    '9/9/9/p1p3p1p/9/4pR3/9/9/9/9 b - - 0 1',
+    '4k4/9/9/9/4p4/9/9/4C1p2/9/3K5 w - - 0 1',
+    '9/9/9/9/9/9/9/4E4/3K1p3/9 w - - 0 1',
+    '9/9/9/p1p6/2e6/9/9/9/9/9 b - - 0 1',
+    '9/4k4/9/9/9/9/4R4/9/9/5K3 b - - 0 1',
+    '4k4/9/9/9/9/4R4/9/9/9/4K4 w - - 0 1',
+    '2eakae2/9/9/9/9/9/9/9/4A4/2E1K4 w - - 0 1',
+]
+
+
+def assert_same(batch, boards):
+    mask = batch.legal_mask()
+    codes = batch.label_codes()
+    done, winner = batch.result(mask)
+    for i, board in enumerate(boards):
+        assert batch.fen(i) == board.fen()
+        assert set(codes[i][mask[i]].tolist()) == {m.code() for m in board.generate_legal_moves()}, board.fen()
+        result = board.result()
+        assert done[i] == (result != '*'), board.fen()
+        assert winner[i] == {'1-0': 1, '0-1': -1}.get(result, 0), board.fen()
+    return mask, codes, done
+
+
+def test_positions():
+    boards = [Board(fen) for fen in FENS]
+    assert_same(BatchBoard.from_boards(boards), boards)
+
+
+def test_random_games():
+    random.seed(7)
+    boards = [Board(fen) for fen in FENS[:4] * 2]
+    batch = BatchBoard.from_boards(boards)
+    for _ in range(60):
+        mask, codes, done = assert_same(batch, boards)
+        labels = np.zeros(len(boards), dtype=int)
+        for i, board in enumerate(boards):
+            if done[i]:
+                board = boards[i] = Board()
+                batch.set_board(i, board)
+                mask[i] = batch.legal_mask()[i]
+                codes[i] = batch.label_codes()[i]
+            labels[i] = random.choice(np.flatnonzero(mask[i]).tolist())
+            board.push(Move.from_code(int(codes[i][labels[i]])))
+        batch.push(labels)
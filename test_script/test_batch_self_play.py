@@ -0,0 +1,35 @@
+import itertools
+
+import numpy as np
+
+from chess_zero.config import Config
+from chess_zero.worker import batch_self_play
+
+
+def test_play_games():
+    config = Config('mini')
+    config.play.batch_games = 3
+    config.play.leaf_batch_size = 4
+    config.play.simulation_num_per_move = 12
+    config.play.max_game_length = 6
+    config.play.resign_threshold = None
+    batch_sizes = []
+
+    def predict(state_planes):
+        assert state_planes.shape[1:] == (14, 10, 9)
+        batch_sizes.append(len(state_planes))
+        k = len(state_planes)
+        return np.full((k, Config.n_labels), 1 / Config.n_labels), np.zeros(k)
+
+    games = list(itertools.islice(batch_self_play.play_games(config, predict), 4))
+    assert len(games) == 4
+    for env, data, seconds in games:
+        # a random game rarely ends by capturing the king before max_game_length
+        assert env.done and 0 < env.num_halfmoves <= 6
+        assert len(data) == env.num_halfmoves
+        for observation, policy, value in data:
+            assert abs(sum(policy) - 1) < 1e-6
+        # white and black moves alternate, each scored from its own side
+        assert [value for _, _, value in data] == [data[0][2] * (-1) ** i for i in range(len(data))]
+    # the leaves of several games share a prediction
+    assert max(batch_sizes) > config.play.leaf_batch_size
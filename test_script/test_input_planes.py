@@ -0,0 +1,38 @@
+import random
+
+import numpy as np
+
+from chess_zero.agent.chinese_chess import Board
+from chess_zero.env import chess_env
+from chess_zero.env.chess_env import canon_input_planes, canon_input_planes_batch, is_black_turn
+
+
+def test_canonical_input_planes():
+    random.seed(3)
+    board = Board()
+    for _ in range(120):
+        planes = board.canonical_input_planes()
+        assert planes.dtype == np.float32
+        assert np.array_equal(planes, canon_input_planes(board.fen())), board.fen()
+        moves = board.generate_legal_move_list()
+        if not moves or board.king(board.turn) is None:
+            break
+        board.push(random.choice(moves))
+
+
+def test_canon_input_planes_batch():
+    random.seed(4)
+    board = Board()
+    fens = []
+    for _ in range(60):
+        fens.append(board.fen())
+        board.push(random.choice(board.generate_legal_move_list()))
+        if board.king(board.turn) is None:
+            break
+    planes, black, move_numbers, scores = canon_input_planes_batch(fens)
+    assert planes.shape == (len(fens), 14, 10, 9) and planes.dtype == np.float32
+    for i, fen in enumerate(fens):
+        assert np.array_equal(planes[i], canon_input_planes(fen))
+        assert black[i] == is_black_turn(fen)
+        assert move_numbers[i] == int(fen.split(' ')[5])
+        assert np.isclose(scores[i], chess_env.testeval(fen))
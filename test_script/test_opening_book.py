@@ -0,0 +1,72 @@
+import numpy as np
+
+from chess_zero.agent.chinese_chess import Board, Move
+from chess_zero.agent.player_chess import ChineseChessPlayer
+from chess_zero.config import Config
+from chess_zero.env.chess_env import ChineseChessEnv
+from chess_zero.lib import opening_book
+from chess_zero.lib.data_helper import write_game_data_to_file
+
+
+def policy(*weighted_moves):
+    pol = np.zeros(Config.n_labels)
+    for ucci, weight in weighted_moves:
+        pol[Config.move_index[Move.from_ucci(ucci).code()]] = weight
+    return list(pol)
+
+
+def write_games(tmp_path):
+    start = Board().fen()
+    board = Board()
+    board.push_ucci("h2e2")
+    reply = board.fen()
+    board.push_ucci("h9g7")
+    write_game_data_to_file(str(tmp_path / "play_1.json"), [
+        [start, policy(("h2e2", 0.75), ("b2e2", 0.25)), 1],
+        [reply, policy(("h9g7", 1.0)), -1],
+        [board.fen(), policy(("h0g2", 1.0)), 1],
+    ])
+    write_game_data_to_file(str(tmp_path / "play_2.json"), [
+        [start, policy(("h2e2", 0.5), ("b2e2", 0.5)), 0],
+    ])
+    return [str(tmp_path / "play_1.json"), str(tmp_path / "play_2.json")]
+
+
+def test_build_and_probe(tmp_path):
+    book = opening_book.OpeningBook(*opening_book.build_book(write_games(tmp_path), depth=2))
+    path = str(tmp_path / "book.npz")
+    book.save(path)
+    book = opening_book.OpeningBook.load(path)
+
+    assert len(book) == 2  # 第3个半回合超出深度
+    codes, weights = book.probe(Board())
+    assert dict(zip(codes.tolist(), weights.tolist())) == {
+        Move.from_ucci("h2e2").code(): 1.25, Move.from_ucci("b2e2").code(): 0.75}
+    board = Board()
+    board.push_ucci("b2e2")
+    assert book.probe(board) is None
+    assert book.choose(board) is None
+
+    board = Board()
+    board.push_ucci("h2e2")
+    assert book.choose(board, diversity=0).ucci() == "h9g7"
+    assert {book.choose(Board()).ucci() for _ in range(50)} == {"h2e2", "b2e2"}
+
+
+def test_player_uses_book(tmp_path):
+    config = Config("mini")
+    config.resource.opening_book_path = str(tmp_path / "book.npz")
+    opening_book.OpeningBook(*opening_book.build_book(write_games(tmp_path), depth=4)).save(
+        config.resource.opening_book_path)
+    config.play.book_depth = 2
+    config.play.book_diversity = 0
+
+    player = ChineseChessPlayer(config, dummy=True)
+    env = ChineseChessEnv().reset()
+    env.step(player.action(env))
+    env.step(player.action(env))
+    assert [m.ucci() for m in env.board.move_stack] == ["h2e2", "h9g7"]
+    assert player.moves == []
+
+    config.play.book_depth = 0
+    assert ChineseChessPlayer(config, dummy=True).book is None
@@ -0,0 +1,17 @@
+from chess_zero.agent.chinese_chess import Board
+from chess_zero.lib.perft import PERFT_SUITE
+
+
+def test_perft_suite():
+    for fen, counts in PERFT_SUITE:
+        board = Board(fen)
+        for depth in (1, 2):
+            assert board.perft(depth) == counts[depth - 1], fen
+        assert board.fen() == fen
+
+
+def test_divide():
+    fen, counts = PERFT_SUITE[0]
+    divide = Board(fen).divide(2)
+    assert len(divide) == counts[0]
+    assert sum(divide.values()) == counts[1]
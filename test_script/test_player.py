@@ -0,0 +1,187 @@
+import numpy as np
+
+from chess_zero.agent.chinese_chess import Move
+from chess_zero.agent.player_chess import ChineseChessPlayer, state_key
+from chess_zero.config import Config
+from chess_zero.env.chess_env import ChineseChessEnv, Winner
+from chess_zero.worker import search_bench
+
+
+class UniformPipe:
+    """Stands in for a model pipe: uniform policy, zero value."""
+
+    def send(self, state_planes):
+        assert state_planes.shape[-3:] == (14, 10, 9)
+        self.batch = len(state_planes) if state_planes.ndim == 4 else None
+
+    def recv(self):
+        if self.batch is not None:
+            return np.full((self.batch, Config.n_labels), 1 / Config.n_labels), np.zeros(self.batch)
+        return np.full(Config.n_labels, 1 / Config.n_labels), 0.0
+
+
+def make_player(simulations=40):
+    config = Config('mini')
+    config.play.search_threads = 4
+    config.play.simulation_num_per_move = simulations
+    return ChineseChessPlayer(config, pipes=[UniformPipe() for _ in range(4)])
+
+
+def test_search_leaves_env_untouched():
+    env = ChineseChessEnv().reset()
+    env.step('h2e2')
+    fen = env.board.fen()
+    player = make_player()
+    player.reset_mcts()
+    player.search_moves(env)
+    assert env.board.fen() == fen
+    policy = player.calc_policy(env)
+    assert abs(policy.sum() - 1) < 1e-6
+    assert state_key(env) in player.tree
+
+
+def test_env_undo():
+    env = ChineseChessEnv().reset()
+    fen = env.board.fen()
+    env.step('h2e2')
+    env.undo()
+    assert env.board.fen() == fen
+    assert env.num_halfmoves == 0
+
+
+def test_action():
+    env = ChineseChessEnv().reset()
+    player = make_player()
+    action = player.action(env, can_stop=False)
+    assert action in [m.ucci() for m in env.board.legal_moves]
+
+
+def test_move_index_tables():
+    policy = np.random.rand(Config.n_labels)
+    flipped = Config.flip_policy(policy)
+    env = ChineseChessEnv().reset()
+    for ucci in ['h2e2', 'h9g7', 'e2e6', 'i9h9']:
+        codes = env.board.generate_legal_move_codes()
+        assert (Config.move_index[codes] >= 0).all()
+        assert [Config.labels[i] for i in Config.move_index[codes]] == \
+               [m.ucci() for m in env.board.generate_legal_move_list()]
+        assert np.array_equal(policy[Config.flipped_move_index[codes]], flipped[Config.move_index[codes]])
+        env.step(ucci)
+
+
+def test_perpetual_check_backs_up_as_loss():
+    env = ChineseChessEnv().update('4k4/9/R8/9/9/9/9/9/9/3K5 w - - 0 1')
+    for ucci in ['a7a9', 'e9e8', 'a9a8', 'e8e9', 'a8a9', 'e9e8', 'a9a8', 'e8e9']:
+        env.step(ucci)
+    player = make_player()
+    player.reset_mcts()
+
+    # checking once more repeats the position a third time: white checked on every move and loses
+    env.step('a8a9')
+    assert env.done and env.winner == Winner.black
+    assert player.search_my_move(env) == 1
+    env.undo()
+
+    # expand the root, then visit each child once: the repetition is backed up as a loss for white
+    vals = [player.search_my_move(env) for _ in range(1 + len(list(env.board.legal_moves)))]
+    assert sorted(vals[1:])[:2] == [-1, 0] and max(vals) == 0
+
+
+def test_node_arrays():
+    env = ChineseChessEnv().reset()
+    player = make_player(simulations=60)
+    player.reset_mcts()
+    player.search_moves(env)
+    node = player.tree[state_key(env)]
+    assert tuple(node.codes) == env.board.legal_move_codes()
+    # every virtual loss has been taken back
+    assert node.n.sum() == node.sum_n == 60 - 1
+    visited = node.n > 0
+    assert np.allclose(node.q[visited], node.w[visited] / node.n[visited])
+    assert (node.q[~visited] == 0).all()
+    assert abs(node.p.sum() - 1) < 1e-6
+
+
+def test_prune_tree_keeps_reachable_subtree():
+    env = ChineseChessEnv().reset()
+    player = make_player(simulations=200)
+    player.search_moves(env)
+    root = player.tree[state_key(env)]
+    # follow the most visited line for two plies
+    for _ in range(2):
+        node = player.tree[state_key(env)]
+        env.step_move(Move.from_code(int(node.codes[np.argmax(node.n)])))
+    kept = player.tree[state_key(env)]
+    size = len(player.tree)
+
+    player.prune_tree(env)
+    assert player.tree[state_key(env)] is kept
+    assert root not in player.tree.values()
+    assert 0 < len(player.tree) < size
+
+    # every kept node is reachable from the new root
+    reachable, frontier = set(), [env.board.copy()]
+    while frontier:
+        board = frontier.pop()
+        key = board.zobrist_hash()
+        if key in reachable or key not in player.tree:
+            continue
+        reachable.add(key)
+        node = player.tree[key]
+        for code in ([] if node.codes is None else node.codes[node.n > 0]):
+            child = board.copy()
+            child.push(Move.from_code(int(code)))
+            frontier.append(child)
+    assert reachable == set(player.tree)
+
+    player.prune_tree(ChineseChessEnv().reset())
+    assert len(player.tree) == 0
+
+
+def test_root_noise_drawn_once():
+    env = ChineseChessEnv().reset()
+    player = make_player(simulations=100)
+    player.play_config.noise_eps = 0.25
+    player.search_moves(env)
+    root = player.tree[state_key(env)]
+    noise = root.noise
+    assert noise.shape == root.p.shape and abs(noise.sum() - 1) < 1e-6
+    # the noise is not uniform, so it actually perturbs the priors
+    assert noise.std() > 0
+    for node in player.tree.values():
+        assert node is root or node.noise is None
+
+    player.prepare_search(env)
+    player.search_moves(env)
+    assert root.noise is not noise
+
+    player.play_config.noise_eps = 0
+    player.prepare_search(env)
+    player.search_moves(env)
+    assert root.noise is None
+
+
+def test_batched_search():
+    env = ChineseChessEnv().reset()
+    env.step('h2e2')
+    fen = env.board.fen()
+    player = make_player(simulations=100)
+    player.play_config.search_mode = 'batched'
+    player.play_config.leaf_batch_size = 8
+    player.reset_mcts()
+    player.search_moves(env)
+    assert env.board.fen() == fen
+    node = player.tree[state_key(env)]
+    # every simulation is backed up once and every virtual loss is taken back
+    assert node.n.sum() == node.sum_n == 100 - 1
+    for node in player.tree.values():
+        if node.codes is not None:
+            assert node.n.sum() == node.sum_n and (node.n >= 0).all()
+    assert player.action(env, can_stop=False) in [m.ucci() for m in env.board.legal_moves]
+
+
+def test_search_benchmark():
+    config = make_player().config
+    config.play.simulation_num_per_move = 20
+    results = search_bench.benchmark(config, [UniformPipe() for _ in range(4)])
+    assert set(results) == {'threads', 'batched'} and min(results.values()) > 0
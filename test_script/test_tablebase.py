@@ -0,0 +1,92 @@
+import random
+
+from chess_zero.agent.chinese_chess import Board, KING, WHITE, BLACK
+from chess_zero.env.chess_env import ChineseChessEnv, Winner
+from chess_zero.lib import tablebase
+
+
+def random_board(layout, turn):
+    squares = []
+    while len(set(squares)) < len(layout.pieces):
+        squares = [random.choice(domain) for domain in layout.domains]
+    board = Board(None)
+    for (color, piece_type), square in zip(layout.pieces, squares):
+        board._set_piece_at(square, piece_type, color)
+    board.turn = turn
+    return board
+
+
+def child_value(tb, board, move):
+    if board.piece_type_at(move.to_square) == KING:
+        return None
+    board.push(move)
+    value = tb.probe(board)
+    board.pop()
+    return value
+
+
+def test_build_and_probe(tmp_path):
+    random.seed(3)
+    tb = tablebase.build_all(["KPk"], str(tmp_path))
+    assert (tmp_path / "KPk.npy").exists()
+
+    tb = tablebase.Tablebase(str(tmp_path))
+    layout = tb.layout("KPk")
+    for _ in range(300):
+        board = random_board(layout, random.choice([WHITE, BLACK]))
+        value = tb.probe(board)
+        children = [child_value(tb, board, move) for move in board.legal_moves]
+        if value > 0:
+            # 存在一步让对方在value - 1步内失败（吃将时为None）
+            assert (None if value == 1 else 1 - value) in children, board.fen()
+            assert not any(c is not None and c < 0 and 1 - c < value for c in children)
+        elif value < 0:
+            assert None not in children and all(c > 0 for c in children), board.fen()
+            assert max(children) == -value - 1
+        else:
+            assert not children or any(c == 0 for c in children), board.fen()
+
+    # 黑方带兵的局面通过上下翻转查询同一张表
+    assert tb.probe(Board("4k4/9/9/9/9/4p4/9/9/9/3K5 w - - 0 1")) == \
+        tb.probe(Board("3k5/9/9/9/4P4/9/9/9/9/4K4 b - - 0 1"))
+    # 子力更多的局面不在库里
+    assert tb.probe(Board()) is None
+
+
+def test_build_all_skips_existing(tmp_path, monkeypatch):
+    built = []
+    build = tablebase.build
+
+    def counting_build(signature, tb):
+        built.append(signature)
+        return build(signature, tb)
+
+    monkeypatch.setattr(tablebase, "build", counting_build)
+    tablebase.build_all(["KPk", "KPka"], str(tmp_path))
+    assert built == ["KPk", "KPka"]
+
+    # 已保存的表（包括黑方带子的镜像签名）不再重新生成
+    built.clear()
+    tablebase.build_all(["KPka", "Kkp"], str(tmp_path))
+    assert built == []
+
+
+def test_env_adjudication():
+    tb = tablebase.build_all(["KRk", "KCk"])
+    env = ChineseChessEnv(tb)
+    env.update("3k5/9/9/9/9/9/9/4R4/9/4K4 w - - 0 1")
+    env.step("e2e1")
+    assert tb.probe(env.board) < 0
+    assert env.done and env.winner == Winner.white and env.result == "1-0"
+
+    # 炮不能单独吃将，KCk全部为和棋
+    env = ChineseChessEnv(tb)
+    env.update("3k5/9/9/9/9/9/9/4C4/9/4K4 w - - 0 1")
+    env.step("e2e1")
+    assert env.done and env.winner == Winner.draw
+
+    # 不带残局库时照常继续
+    env = ChineseChessEnv()
+    env.update("3k5/9/9/9/9/9/9/4R4/9/4K4 w - - 0 1")
+    env.step("e2e1")
+    assert not env.done